@@ -1,7 +1,27 @@
-from typing import Tuple, Callable, List, Optional
+from typing import Tuple, Callable, List, Optional, Sequence, Union, Iterable, Iterator, Dict, BinaryIO
+import array
+import codecs
+import collections
+import collections.abc
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import mmap
+import os
 import random
+import struct
+import tempfile
+import time
+import urllib.error
 import urllib.request
 import sys
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 def bullscows(guess: str, secret: str) -> Tuple[int, int]:
     bulls = sum(g == s for g, s in zip(guess, secret))
@@ -23,10 +43,346 @@ def bullscows(guess: str, secret: str) -> Tuple[int, int]:
     return bulls, cows
 
 
+# Сколько байт промежуточных массивов допускается при попарном сравнении блоками
+BLOCK_BYTES = 64 << 20
+
+
+class EncodedWords:
+    """Словарь, один раз переведённый в массивы NumPy
+
+    codes[i, j] — код j-й буквы i-го слова (0 после конца слова),
+    counts[i, k] — сколько раз буква alphabet[k] встречается в i-м слове.
+    """
+
+    def __init__(self, words: Sequence[str]):
+        if np is None:
+            raise ImportError("Для пакетного подсчёта быков и коров нужен NumPy")
+
+        if isinstance(words, WordBucket):
+            # Скомпилированный словарь уже хранит слова как коды UTF-32 фиксированной ширины
+            self.words = words
+            self.codes = words.codes()
+            width = words.length
+        else:
+            self.words = list(words)
+            width = max(map(len, self.words), default=0)
+            text = "".join(word.ljust(width, "\0") for word in self.words)
+            self.codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+            self.codes = self.codes.reshape(len(self.words), width)
+
+        self.alphabet = np.unique(self.codes[self.codes != 0])
+        self.letters = {chr(code): index for index, code in enumerate(self.alphabet.tolist())}
+
+        rows, columns = np.nonzero(self.codes)
+        letters = np.searchsorted(self.alphabet, self.codes[rows, columns])
+        size = len(self.alphabet)
+        counts = np.bincount(rows * size + letters, minlength=len(self.words) * size)
+        self.counts = counts.astype(np.uint8 if width < 256 else np.uint16).reshape(len(self.words), size)
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def encode_guess(self, guess: str) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        # Коды букв догадки в пределах ширины словаря, номера её букв в алфавите и их число
+        codes = np.array([ord(char) for char in guess[:self.codes.shape[1]]], dtype=np.uint32)
+        letters = {}
+        for char in guess:
+            if char in self.letters:
+                letters[self.letters[char]] = letters.get(self.letters[char], 0) + 1
+        indices = np.array(list(letters), dtype=np.intp)
+        return codes, indices, np.array(list(letters.values()), dtype=self.counts.dtype)
+
+
+def bullscows_many(guess: str, words: Union[Sequence[str], EncodedWords]) -> Tuple["np.ndarray", "np.ndarray"]:
+    # То же, что bullscows(guess, word) для каждого слова, но одним проходом по массивам
+    if not isinstance(words, EncodedWords):
+        words = EncodedWords(words)
+
+    codes, letters, counts = words.encode_guess(guess)
+    bulls = (words.codes[:, :len(codes)] == codes).sum(axis=1, dtype=np.int32)
+    common = np.minimum(words.counts[:, letters], counts).sum(axis=1, dtype=np.int32)
+    return bulls, common - bulls
+
+
+def bullscows_block(guesses: Union[Sequence[int], "np.ndarray"],
+                    words: EncodedWords) -> Tuple["np.ndarray", "np.ndarray"]:
+    # Быки и коровы для слов словаря с номерами guesses против всех слов:
+    # две матрицы len(guesses) x len(words), считаются блоками не больше BLOCK_BYTES
+    guesses = np.asarray(guesses, dtype=np.intp)
+    bulls = np.empty((len(guesses), len(words)), dtype=np.int32)
+    cows = np.empty_like(bulls)
+
+    width = max(words.codes.shape[1] * 4, words.counts.shape[1] * words.counts.itemsize, 1)
+    step = max(1, BLOCK_BYTES // (width * max(len(words), 1)))
+    for start in range(0, len(guesses), step):
+        chunk = guesses[start:start + step]
+        left = words.codes[chunk, None, :]
+        block_bulls = ((left == words.codes[None, :, :]) & (left != 0)).sum(axis=2, dtype=np.int32)
+        common = np.minimum(words.counts[chunk, None, :], words.counts[None, :, :]).sum(axis=2, dtype=np.int32)
+        bulls[start:start + step] = block_bulls
+        cows[start:start + step] = common - block_bulls
+    return bulls, cows
+
+
+def default_cache_dir() -> str:
+    return os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "bullscows")
+
+
+def open_matrix(path: str, dtype, shape: Tuple[int, ...]) -> "np.ndarray":
+    # Файл .npy, отображённый в память; новый создаётся разреженным и заполняется по мере счёта
+    if os.path.exists(path):
+        return np.lib.format.open_memmap(path, mode="r+")
+    temporary = f"{path}.{os.getpid()}.tmp"
+    np.lib.format.open_memmap(temporary, mode="w+", dtype=dtype, shape=shape).flush()
+    os.replace(temporary, path)
+    return np.lib.format.open_memmap(path, mode="r+")
+
+
+class FeedbackMatrix:
+    """Ответы для всех пар слов одной длины L, закодированные одним числом bulls * (L + 1) + cows
+
+    Строка считается при первом обращении; с каталогом кэша матрица и отметки о готовых
+    строках лежат в файлах, названных по хэшу словаря, и переживают перезапуск.
+    """
+
+    def __init__(self, words: EncodedWords, cache_dir: Optional[str] = None):
+        self.words = words
+        self.base = words.codes.shape[1] + 1
+        dtype = np.uint8 if self.base ** 2 <= 256 else np.uint16
+        size = len(words)
+
+        if cache_dir is None:
+            self.path = None
+            self.matrix = np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode="w+", shape=(size, size))
+            self.ready = np.zeros(size, dtype=np.uint8)
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+            digest = hashlib.sha1("\n".join(words.words).encode("utf-8")).hexdigest()
+            self.path = os.path.join(cache_dir, digest)
+            self.matrix = open_matrix(f"{self.path}.feedback.npy", dtype, (size, size))
+            self.ready = open_matrix(f"{self.path}.rows.npy", np.uint8, (size,))
+
+    def code(self, bulls: int, cows: int) -> int:
+        return bulls * self.base + cows
+
+    def rows(self, indices: Union[Sequence[int], "np.ndarray"]) -> "np.ndarray":
+        indices = np.asarray(indices, dtype=np.intp)
+        missing = np.unique(indices[self.ready[indices] == 0])
+        if len(missing):
+            self.compute(missing)
+        return self.matrix[indices]
+
+    def compute(self, indices: "np.ndarray") -> None:
+        # Сначала строка, потом отметка: другой процесс с тем же кэшем не прочтёт недописанное
+        step = max(1, BLOCK_BYTES // (8 * len(self.words)))
+        for start in range(0, len(indices), step):
+            chunk = indices[start:start + step]
+            bulls, cows = bullscows_block(chunk, self.words)
+            self.matrix[chunk] = bulls * self.base + cows
+            self.ready[chunk] = 1
+
+
+class Solver:
+    """Автоматический игрок: solver.ask и solver.inform подставляются в gameplay() вместо человека
+
+    Хранит номера слов, согласных со всеми ответами, и загадывает то, что лучше всего
+    дробит их по возможным ответам: максимум энтропии или минимум худшей группы (minimax).
+    Стратегия random берёт любое подходящее слово — нижняя планка для сравнения.
+    """
+
+    def __init__(self, words: Union[Sequence[str], EncodedWords], strategy: str = "entropy",
+                 cache_dir: Optional[str] = None, pool_size: int = 256, seed: Optional[int] = None):
+        if strategy not in ("entropy", "minimax", "random"):
+            raise ValueError(f"Неизвестная стратегия: {strategy}")
+
+        self.words = words if isinstance(words, EncodedWords) else EncodedWords(words)
+        self.index = {word: number for number, word in enumerate(self.words.words)}
+        self.feedback = FeedbackMatrix(self.words, cache_dir)
+        self.strategy = strategy
+        self.pool_size = pool_size
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self, seed: Optional[Union[int, str]] = None) -> None:
+        if seed is not None:
+            self.random.seed(seed)
+        self.candidates = np.arange(len(self.words))
+        self.guesses = 0
+        self.last_guess = None
+
+    def score(self, pool: "np.ndarray") -> "np.ndarray":
+        # Чем меньше, тем лучше догадка
+        block = self.feedback.rows(pool)[:, self.candidates].astype(np.intp)
+        size = self.feedback.base ** 2
+        block += np.arange(len(pool))[:, None] * size
+        groups = np.bincount(block.ravel(), minlength=len(pool) * size).reshape(len(pool), size)
+
+        if self.strategy == "minimax":
+            return groups.max(axis=1)
+        share = groups / len(self.candidates)
+        logs = np.log2(share, out=np.zeros_like(share), where=share > 0)
+        return (share * logs).sum(axis=1)
+
+    def opening_path(self) -> Optional[str]:
+        if self.feedback.path is None:
+            return None
+        return f"{self.feedback.path}.openings.json"
+
+    def load_opening(self) -> Optional[int]:
+        path = self.opening_path()
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as file:
+            return json.load(file).get(self.strategy)
+
+    def save_opening(self, guess: int) -> None:
+        path = self.opening_path()
+        if path is None:
+            return
+        openings = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                openings = json.load(file)
+        openings[self.strategy] = guess
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(openings, file)
+        os.replace(temporary, path)
+
+    def choose(self) -> int:
+        if not len(self.candidates):
+            raise ValueError("Нет слов, согласных со всеми ответами")
+        if len(self.candidates) <= 2:
+            return int(self.candidates[0])
+        if self.strategy == "random":
+            return int(self.random.choice(self.candidates))
+
+        # Первый ход не зависит от игры, поэтому считается один раз на словарь
+        opening = self.load_opening() if self.guesses == 0 else None
+        if opening is not None:
+            return opening
+
+        pool = self.candidates
+        if len(pool) > self.pool_size:
+            pool = np.sort(np.array(self.random.sample(list(pool), self.pool_size)))
+        guess = int(pool[np.argmin(self.score(pool))])
+
+        if self.guesses == 0:
+            self.save_opening(guess)
+        return guess
+
+    def update(self, guess: str, bulls: int, cows: int) -> None:
+        if guess in self.index:
+            row = self.feedback.rows([self.index[guess]])[0, self.candidates]
+        else:
+            guess_bulls, guess_cows = bullscows_many(guess, self.words)
+            row = (guess_bulls * self.feedback.base + guess_cows)[self.candidates]
+        self.candidates = self.candidates[row == self.feedback.code(bulls, cows)]
+        self.guesses += 1
+
+    def ask(self, prompt: str, valid: Optional[List[str]] = None) -> str:
+        self.last_guess = self.words.words[self.choose()]
+        return self.last_guess
+
+    def inform(self, format_string: str, bulls: int, cows: int) -> None:
+        self.update(self.last_guess, bulls, cows)
+
+
+class CandidateTracker:
+    """Слова, согласные со всеми ответами
+
+    Каждый ответ фильтрует только выживших кандидатов, а сигнатура слова (сколько раз
+    встречается каждая буква) считается один раз и переживает reset, поэтому после первого
+    хода работа почти ничего не стоит даже на огромном словаре. Прежние списки лежат
+    в стеке: откат хода и возврат к снимку мгновенные.
+    """
+
+    def __init__(self, words: Sequence[str]):
+        self.words = words
+        self.signatures = {}
+        self.encoded = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.history = []
+        self.candidates = range(len(self.words))
+
+    def signature(self, index: int) -> Tuple[str, dict]:
+        cached = self.signatures.get(index)
+        if cached is None:
+            word = self.word(index)
+            counts = {}
+            for char in word:
+                counts[char] = counts.get(char, 0) + 1
+            cached = self.signatures[index] = (word, counts)
+        return cached
+
+    @property
+    def remaining(self) -> int:
+        return len(self.candidates)
+
+    def word(self, index: int) -> str:
+        if isinstance(self.words, EncodedWords):
+            return self.words.words[index]
+        return self.words[index]
+
+    def remaining_words(self) -> List[str]:
+        return [self.word(index) for index in self.candidates]
+
+    def update(self, guess: str, bulls: int, cows: int) -> int:
+        self.history.append((guess, bulls, cows, self.candidates))
+        if np is not None and isinstance(self.candidates, range):
+            # Первый ход проходит по всему словарю — с NumPy это один векторный проход
+            if self.encoded is None:
+                self.encoded = self.words if isinstance(self.words, EncodedWords) else EncodedWords(self.words)
+            guess_bulls, guess_cows = bullscows_many(guess, self.encoded)
+            self.candidates = np.flatnonzero((guess_bulls == bulls) & (guess_cows == cows)).tolist()
+            return len(self.candidates)
+
+        guess_counts = {}
+        for char in guess:
+            guess_counts[char] = guess_counts.get(char, 0) + 1
+        common = bulls + cows
+
+        survivors = []
+        for index in self.candidates:
+            word, counts = self.signature(index)
+            # Сначала общее число букв: оно отсекает большинство слов без сравнения позиций
+            if sum(min(count, counts.get(char, 0)) for char, count in guess_counts.items()) != common:
+                continue
+            if sum(g == s for g, s in zip(guess, word)) != bulls:
+                continue
+            survivors.append(index)
+
+        self.candidates = survivors
+        return len(survivors)
+
+    def undo(self) -> Tuple[str, int, int]:
+        if not self.history:
+            raise IndexError("Нечего отменять")
+        guess, bulls, cows, self.candidates = self.history.pop()
+        return guess, bulls, cows
+
+    def snapshot(self) -> tuple:
+        # Списки кандидатов не меняются на месте, поэтому снимку хватает ссылок на них
+        return tuple(self.history), self.candidates
+
+    def restore(self, snapshot: tuple) -> None:
+        history, self.candidates = snapshot
+        self.history = list(history)
+
+
 def gameplay(ask: Callable[[str, Optional[List[str]]], str],
              inform: Callable[[str, int, int], None],
-             words: List[str]) -> int:
-    secret_word = random.choice(words)
+             words: List[str],
+             secret_word: Optional[str] = None,
+             tracker: Optional[CandidateTracker] = None) -> int:
+    # С tracker после каждого ответа в строку для inform добавляется число слов,
+    # которые ещё могут быть загаданы; само число доступно как tracker.remaining
+    if secret_word is None:
+        secret_word = random.choice(words)
+    if tracker is not None:
+        tracker.reset()
     attempts = 0
 
     while True:
@@ -34,41 +390,363 @@ def gameplay(ask: Callable[[str, Optional[List[str]]], str],
         attempts += 1
 
         bulls, cows = bullscows(guess, secret_word)
-        inform("Быки: {}, Коровы: {}", bulls, cows)
+        if tracker is None:
+            inform("Быки: {}, Коровы: {}", bulls, cows)
+        else:
+            remaining = tracker.update(guess, bulls, cows)
+            inform(f"Быки: {{}}, Коровы: {{}}. Осталось слов: {remaining}", bulls, cows)
 
         if bulls == len(secret_word):
             return attempts
 
 
-def read_dictionary(source: str) -> List[str]:
+READ_CHUNK = 1 << 16
+GZIP_MAGIC = b"\x1f\x8b"
 
+
+def iter_words(stream: BinaryIO, length: Optional[int] = None, unique: bool = True) -> Iterator[str]:
+    # Читаем поток кусками и декодируем по мере чтения: в памяти держим только
+    # текущий кусок и уже выданные слова нужной длины, а не весь файл.
+    # Кто и так собирает слова в множества (compile_dictionary), отключает unique,
+    # чтобы не хранить второе множество тех же слов
+    if stream.peek(len(GZIP_MAGIC))[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    seen = set()
+    tail = ""
+    while True:
+        chunk = stream.read(READ_CHUNK)
+        text = tail + decoder.decode(chunk, final=not chunk)
+        words = text.split()
+
+        # Последнее слово куска может продолжиться в следующем
+        tail = words.pop() if chunk and words and not text[-1].isspace() else ""
+
+        for word in words:
+            if length is not None and len(word) != length:
+                continue
+            if unique:
+                if word in seen:
+                    continue
+                seen.add(word)
+            yield word
+
+        if not chunk:
+            break
+
+
+def iter_dictionary(source: str, length: Optional[int] = None, unique: bool = True) -> Iterator[str]:
+    # Файл, файл .gz или адрес в сети; сжатие определяется по содержимому
     if source.startswith(('http://', 'https://')):
         with urllib.request.urlopen(source) as response:
-            content = response.read().decode('utf-8')
+            yield from iter_words(response, length, unique)
+    else:
+        with open(source, 'rb') as file:
+            yield from iter_words(file, length, unique)
+
+
+def read_dictionary(source: str, length: Optional[int] = None) -> List[str]:
+    return list(iter_dictionary(source, length))
+
+
+# Скомпилированный словарь: заголовок с JSON-оглавлением, затем для каждой длины слова
+# отсортированные слова в UTF-32 фиксированной ширины и хэш-таблица их номеров
+DICTIONARY_MAGIC = b"BCDICT01"
+DICTIONARY_HEADER = struct.Struct("<8sI")
+
+
+def word_key(word: str) -> bytes:
+    return word.encode("utf-32-le")
+
+
+class WordBucket(collections.abc.Sequence):
+    """Слова одной длины прямо из отображённого в память файла
+
+    Индексация без распаковки всего списка и проверка «слово есть в словаре» за O(1).
+    """
+
+    def __init__(self, data: memoryview, table: memoryview, length: int, count: int):
+        self.data = data
+        self.table = table
+        self.length = length
+        self.count = count
+        self.width = 4 * length
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        start = index * self.width
+        return bytes(self.data[start:start + self.width]).decode("utf-32-le")
+
+    def __contains__(self, word) -> bool:
+        if not isinstance(word, str) or len(word) != self.length or not self.count:
+            return False
+        key = word_key(word)
+        mask = len(self.table) - 1
+        slot = zlib.crc32(key) & mask
+        while self.table[slot]:
+            start = (self.table[slot] - 1) * self.width
+            if self.data[start:start + self.width] == key:
+                return True
+            slot = (slot + 1) & mask
+        return False
+
+    def codes(self) -> "np.ndarray":
+        return np.frombuffer(self.data, dtype=np.uint32).reshape(self.count, self.length)
+
+
+class Dictionary:
+    """Скомпилированный словарь, отображённый в память; слова выдаются корзинами по длине"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = DICTIONARY_HEADER.unpack_from(self.map)
+        if magic != DICTIONARY_MAGIC:
+            raise ValueError(f"{path}: это не скомпилированный словарь")
+        self.meta = json.loads(bytes(self.map[DICTIONARY_HEADER.size:DICTIONARY_HEADER.size + size]))
+        self.base = DICTIONARY_HEADER.size + size
+
+    def lengths(self) -> List[int]:
+        return sorted(map(int, self.meta["buckets"]))
+
+    def words(self, length: int) -> WordBucket:
+        bucket = self.meta["buckets"].get(str(length))
+        view = memoryview(self.map)
+        if bucket is None:
+            return WordBucket(view[:0], view[:0].cast("I"), length, 0)
+        words = view[self.base + bucket["words"]:self.base + bucket["table"]]
+        table = view[self.base + bucket["table"]:self.base + bucket["table"] + 4 * bucket["slots"]]
+        return WordBucket(words, table.cast("I"), length, bucket["count"])
+
+
+def compile_dictionary(words: Iterable[str], path: str, meta: Dict) -> None:
+    buckets = {}
+    for word in words:
+        if word:
+            buckets.setdefault(len(word), set()).add(word)
+
+    # Размеры частей зависят только от числа слов, поэтому оглавление пишется сразу,
+    # а каждая длина записывается и освобождается по очереди
+    layout = {}
+    offset = 0
+    for length in sorted(buckets):
+        count = len(buckets[length])
+        # Открытая адресация, таблица заполнена не больше чем наполовину
+        slots = 1 << (2 * count - 1).bit_length()
+        layout[str(length)] = {"count": count, "words": offset, "table": offset + 4 * length * count, "slots": slots}
+        offset += 4 * length * count + 4 * slots
+
+    header = json.dumps(dict(meta, buckets=layout)).encode("utf-8")
+    header += b" " * (-(DICTIONARY_HEADER.size + len(header)) % 4)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(DICTIONARY_HEADER.pack(DICTIONARY_MAGIC, len(header)))
+        file.write(header)
+        for length in sorted(buckets):
+            bucket = sorted(buckets.pop(length))
+            slots = layout[str(length)]["slots"]
+            table = array.array("I", bytes(4 * slots))
+            for index, word in enumerate(bucket):
+                key = word_key(word)
+                file.write(key)
+                slot = zlib.crc32(key) & (slots - 1)
+                while table[slot]:
+                    slot = (slot + 1) & (slots - 1)
+                table[slot] = index + 1
+            table.tofile(file)
+    os.replace(temporary, path)
+
+
+def load_dictionary(source: str, cache_dir: Optional[str] = None) -> Dictionary:
+    # Словарь компилируется при первом запуске и берётся из кэша, пока источник не изменился:
+    # у файла сверяются mtime и размер, у адреса — ETag и Last-Modified
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, hashlib.sha1(source.encode("utf-8")).hexdigest() + ".dict")
+
+    try:
+        compiled = Dictionary(path)
+    except (OSError, ValueError):
+        compiled = None
+    validator = compiled.meta.get("validator", {}) if compiled is not None else {}
+
+    if source.startswith(('http://', 'https://')):
+        request = urllib.request.Request(source)
+        if validator.get("etag"):
+            request.add_header("If-None-Match", validator["etag"])
+        if validator.get("last_modified"):
+            request.add_header("If-Modified-Since", validator["last_modified"])
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as error:
+            if error.code == 304 and compiled is not None:
+                return compiled
+            raise
+        except urllib.error.URLError:
+            # Нет сети — играем на том, что скачали в прошлый раз
+            if compiled is not None:
+                return compiled
+            raise
+        current = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+        with response:
+            compile_dictionary(iter_words(response, unique=False), path, {"source": source, "validator": current})
     else:
-        with open(source, 'r', encoding='utf-8') as file:
-            content = file.read()
+        stat = os.stat(source)
+        current = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+        if compiled is not None and validator == current:
+            return compiled
+        compile_dictionary(iter_dictionary(source, unique=False), path, {"source": source, "validator": current})
+
+    return Dictionary(path)
+
+
+# Состояние процесса-участника турнира: словарь и игрок создаются один раз на процесс
+tournament_words = None
+tournament_player = None
+
+
+def start_tournament_worker(source: str, length: int, strategy, cache_dir: Optional[str]) -> None:
+    global tournament_words, tournament_player
+    tournament_words = load_dictionary(source, cache_dir).words(length)
+    if callable(strategy):
+        tournament_player = strategy(tournament_words)
+    else:
+        tournament_player = Solver(tournament_words, strategy, cache_dir=cache_dir)
+
+
+def play_tournament_chunk(indices: List[int], seed: Optional[int]) -> List[int]:
+    results = []
+    for index in indices:
+        tournament_player.reset(None if seed is None else f"{seed}:{index}")
+        results.append(gameplay(tournament_player.ask, tournament_player.inform,
+                                tournament_words, tournament_words[index]))
+    return results
+
+
+def tournament(source: str, length: int, strategy="entropy", sample: Optional[int] = None,
+               processes: Optional[int] = None, chunk_size: Optional[int] = None,
+               seed: Optional[int] = None, cache_dir: Optional[str] = None) -> dict:
+    # Играет gameplay() против каждого слова длины length (или случайной выборки из sample слов)
+    # в пуле процессов. strategy — имя стратегии Solver или функция words -> игрок с методами
+    # reset(seed), ask и inform; функция должна быть видна на уровне модуля, чтобы её можно
+    # было передать в процессы. С одинаковым seed результаты повторяются.
+    cache_dir = cache_dir or default_cache_dir()
+    words = load_dictionary(source, cache_dir).words(length)
+    if not words:
+        raise ValueError(f"В словаре нет слов длины {length}")
+
+    for name, value in (("sample", sample), ("processes", processes), ("chunk_size", chunk_size)):
+        if value is not None and value < 1:
+            raise ValueError(f"Параметр {name} должен быть положительным")
 
-    return [word.strip() for word in content.split() if word.strip()]
+    indices = list(range(len(words)))
+    if sample is not None and sample < len(indices):
+        indices = sorted(random.Random(seed).sample(indices, sample))
+
+    processes = processes or os.cpu_count() or 1
+    # Несколько кусков на процесс, чтобы долгие партии не оставляли остальных без работы
+    chunk_size = chunk_size or max(1, min(256, len(indices) // (8 * processes)))
+    chunks = [indices[start:start + chunk_size] for start in range(0, len(indices), chunk_size)]
+
+    # Первый ход и матрица ответов считаются здесь и ложатся в кэш до запуска пула,
+    # иначе каждый процесс посчитал бы их заново
+    started = time.perf_counter()
+    start_tournament_worker(source, length, strategy, cache_dir)
+    tournament_player.reset(seed)
+    tournament_player.ask("", None)
+    warmup = time.perf_counter() - started
+
+    attempts = []
+    started = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=start_tournament_worker,
+                                                initargs=(source, length, strategy, cache_dir)) as executor:
+        for results in executor.map(play_tournament_chunk, chunks, [seed] * len(chunks)):
+            attempts += results
+    elapsed = time.perf_counter() - started
+
+    distribution = collections.Counter(attempts)
+    return {
+        "source": source,
+        "length": length,
+        "strategy": strategy if isinstance(strategy, str) else f"{strategy.__module__}.{strategy.__qualname__}",
+        "words": len(words),
+        "games": len(attempts),
+        "seed": seed,
+        "processes": processes,
+        "chunk_size": chunk_size,
+        "warmup_seconds": round(warmup, 3),
+        "seconds": round(elapsed, 3),
+        "games_per_second": round(len(attempts) / elapsed, 1),
+        "mean_attempts": round(sum(attempts) / len(attempts), 4),
+        "max_attempts": max(attempts),
+        "distribution": {str(count): distribution[count] for count in sorted(distribution)},
+    }
+
+
+def option(name: str) -> Optional[str]:
+    # Значение флага вида --name=value; пустая строка, если флаг указан без значения
+    for arg in sys.argv[1:]:
+        flag, _, value = arg.partition("=")
+        if flag == f"--{name}":
+            return value
+    return None
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Использование: python -m bullscows словарь [длина]")
+    # --solver[=entropy|minimax|random] — играет компьютер;
+    # --tournament — компьютер играет против всех слов длины и печатает отчёт в JSON
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    strategy = option("solver")
+    if strategy == "":
+        strategy = "entropy"
+
+    if len(args) < 1:
+        print("Использование: python -m bullscows словарь [длина] [--solver[=entropy|minimax|random]]\n"
+              "                [--tournament [--sample=N] [--processes=N] [--chunk=N] [--seed=N] [--output=файл]]")
         return
 
-    dictionary_source = sys.argv[1]
+    dictionary_source = args[0]
     word_length = 5
 
-    if len(sys.argv) > 2:
+    if len(args) > 1:
         try:
-            word_length = int(sys.argv[2])
+            word_length = int(args[1])
         except ValueError:
             print("Ошибка: длина должна быть целым числом")
             return
 
-    all_words = read_dictionary(dictionary_source)
-    words_of_length = [word for word in all_words if len(word) == word_length]
+    if option("tournament") is not None:
+        try:
+            numbers = {name: int(option(name)) if option(name) else None
+                       for name in ("sample", "processes", "chunk", "seed")}
+        except ValueError:
+            print("Ошибка: параметры турнира должны быть целыми числами")
+            return
+        if any(numbers[name] is not None and numbers[name] < 1 for name in ("sample", "processes", "chunk")):
+            print("Ошибка: --sample, --processes и --chunk должны быть положительными")
+            return
+        report = tournament(dictionary_source, word_length, strategy or "entropy", numbers["sample"],
+                            numbers["processes"], numbers["chunk"], numbers["seed"])
+        text = json.dumps(report, ensure_ascii=False, indent=2)
+        output = option("output")
+        if output:
+            with open(output, "w", encoding="utf-8") as file:
+                file.write(text + "\n")
+        else:
+            print(text)
+        return
+
+    words_of_length = load_dictionary(dictionary_source).words(word_length)
 
     if not words_of_length:
         print(f"Ошибка: в словаре нет слов длины {word_length}")
@@ -86,7 +764,19 @@ def main():
     def inform_func(format_string: str, bulls: int, cows: int) -> None:
         print(format_string.format(bulls, cows))
 
-    attempts = gameplay(ask_func, inform_func, words_of_length)
+    if strategy is not None:
+        solver = Solver(words_of_length, strategy, cache_dir=default_cache_dir())
+
+        def ask_func(prompt: str, valid: List[str] = None) -> str:
+            guess = solver.ask(prompt, valid)
+            print(prompt + guess)
+            return guess
+
+        def inform_func(format_string: str, bulls: int, cows: int) -> None:
+            solver.inform(format_string, bulls, cows)
+            print(format_string.format(bulls, cows))
+
+    attempts = gameplay(ask_func, inform_func, words_of_length, tracker=CandidateTracker(words_of_length))
     print(f"Поздравляем! Вы угадали слово за {attempts} попыток.")
 
 if __name__ == "__main__":
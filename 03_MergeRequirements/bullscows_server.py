@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import os
+import random
+import time
+
+import bullscows
+from bullscows import np
+
+parser = argparse.ArgumentParser(description='Сервер игры «Быки и коровы» для многих игроков')
+parser.add_argument('dictionary', type=str, nargs='?', default=None,
+                    help='Словарь: путь к файлу (можно .gz) или адрес в сети')
+parser.add_argument('--length', type=int, default=5, help='Длина загадываемых слов')
+parser.add_argument('--host', type=str, default='0.0.0.0', help='Адрес, на котором слушает сервер')
+parser.add_argument('--port', type=int, default=1338, help='Порт сервера')
+parser.add_argument('--backlog', type=int, default=1024,
+                    help='Длина очереди входящих соединений')
+parser.add_argument('--max-connections', type=int, default=10000,
+                    help='Максимальное число одновременных игроков (0 — без ограничения)')
+parser.add_argument('--idle-timeout', type=float, default=600.0,
+                    help='Через сколько секунд тишины закрывать соединение (0 — никогда)')
+parser.add_argument('--max-line', type=int, default=1024,
+                    help='Максимальная длина команды в байтах')
+parser.add_argument('--hints', action='store_true',
+                    help='Сообщать после каждого хода, сколько слов ещё может быть загадано (нужен NumPy)')
+parser.add_argument('--hint-workers', type=int, default=4,
+                    help='Число потоков, в которых сужается множество кандидатов')
+parser.add_argument('--hint-cache', type=int, default=1024,
+                    help='Сколько результатов первого хода хранить общими для всех игр')
+
+config = parser.parse_args([])
+
+# В построчном режиме каждый ответ завершается пустой строкой, как в коровьем чате
+END_OF_BLOCK = b"\n"
+
+HELP = (
+    "Доступные команды:\n"
+    "- <слово> или guess <слово> — попытка угадать\n"
+    "- new — начать новую игру\n"
+    "- giveup — сдаться и узнать слово\n"
+    "- quit — отключиться\n"
+    "- help — показать это сообщение\n"
+).encode()
+GOODBYE = "До свидания!\n".encode()
+GUESS_USAGE = "Ошибка: Используйте 'guess <слово>'\n".encode()
+UNKNOWN_WORD = "Такого слова нет в списке. Попробуйте еще раз.\n".encode()
+SERVER_FULL = "Ошибка: Сервер переполнен, попробуйте позже\n".encode()
+IDLE_TIMEOUT = "Соединение закрыто из-за неактивности\n".encode()
+LINE_TOO_LONG = "Ошибка: Слишком длинная команда\n".encode()
+
+# Общий для всех игр словарь: слова одной длины из отображённого в память скомпилированного
+# файла и, для подсказок, их коды; ни то ни другое после запуска не меняется
+words = None
+encoded = None
+hint_pool = None
+first_hints = None
+
+games_started = 0
+games_won = 0
+connections = 0
+
+
+class Game:
+    """Состояние одной партии: номер загаданного слова, число попыток и кандидаты
+
+    Кандидаты хранятся в самом компактном виде: None — весь словарь, массив uint32 —
+    несколько номеров, bytes — битовая карта на весь словарь. Больше len(words) / 8
+    байт на игру они не занимают.
+    """
+
+    __slots__ = ('secret', 'attempts', 'candidates')
+
+    def __init__(self):
+        global games_started
+        games_started += 1
+        self.secret = random.randrange(len(words))
+        self.attempts = 0
+        self.candidates = None
+
+    @property
+    def secret_word(self):
+        return words[self.secret]
+
+
+def candidate_indices(candidates):
+    if isinstance(candidates, bytes):
+        return np.flatnonzero(np.unpackbits(np.frombuffer(candidates, dtype=np.uint8), count=len(words)))
+    return candidates
+
+
+def pack_candidates(indices):
+    # Номер занимает 4 байта, бит карты — 1/8 байта на каждое слово словаря
+    if 4 * len(indices) < len(words) // 8:
+        return indices.astype(np.uint32)
+    mask = np.zeros(len(words), dtype=bool)
+    mask[indices] = True
+    return np.packbits(mask).tobytes()
+
+
+def narrow_all(guess, bulls, cows):
+    """Первый ход: проход по всему словарю без копирования строк по номерам
+
+    Результат зависит только от догадки и ответа, поэтому кэшируется, а одна и та же
+    неизменяемая карта кандидатов достаётся всем играм с тем же первым ходом.
+    """
+    guess_bulls, guess_cows = bullscows.bullscows_many(guess, encoded)
+    survivors = np.flatnonzero((guess_bulls == bulls) & (guess_cows == cows))
+    return pack_candidates(survivors), len(survivors)
+
+
+def narrow(candidates, guess, bulls, cows):
+    """Оставить кандидатов, согласных с ответом; выполняется в пуле потоков"""
+    if candidates is None:
+        return first_hints(guess, bulls, cows)
+
+    indices = candidate_indices(candidates)
+    codes, letters, counts = encoded.encode_guess(guess)
+    guess_bulls = (encoded.codes[indices, :len(codes)] == codes).sum(axis=1, dtype=np.int32)
+    common = np.minimum(encoded.counts[np.ix_(indices, letters)], counts).sum(axis=1, dtype=np.int32)
+    survivors = indices[(guess_bulls == bulls) & (common - guess_bulls == cows)]
+    return pack_candidates(survivors), len(survivors)
+
+
+class Session:
+    """Одно подключение игрока и его текущая партия"""
+
+    __slots__ = ('reader', 'writer', 'game', 'closing')
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.game = Game()
+        self.closing = False
+
+    def reply(self, data):
+        self.writer.writelines((data, END_OF_BLOCK))
+
+    def new_game(self):
+        self.game = Game()
+        self.reply(f"Новая игра: загадано слово из {config.length} букв\n".encode())
+
+
+async def handle_guess(session, guess):
+    global games_won
+    if not guess:
+        session.reply(GUESS_USAGE)
+        return
+    if guess not in words:
+        session.reply(UNKNOWN_WORD)
+        return
+
+    game = session.game
+    game.attempts += 1
+    bulls, cows = bullscows.bullscows(guess, game.secret_word)
+
+    if bulls == config.length:
+        games_won += 1
+        session.reply(f"Быки: {bulls}, Коровы: {cows}\n"
+                      f"Поздравляем! Вы угадали слово за {game.attempts} попыток.\n".encode())
+        session.new_game()
+        return
+
+    if not config.hints:
+        session.reply(f"Быки: {bulls}, Коровы: {cows}\n".encode())
+        return
+
+    # Сужение идёт по всему словарю на первом ходу, поэтому не в цикле событий
+    candidates, remaining = await asyncio.get_running_loop().run_in_executor(
+        hint_pool, narrow, game.candidates, guess, bulls, cows)
+    if session.game is game:
+        game.candidates = candidates
+    session.reply(f"Быки: {bulls}, Коровы: {cows}. Осталось слов: {remaining}\n".encode())
+
+
+async def handle_command(session, data):
+    parts = data.decode(errors='replace').split(None, 1)
+    verb = parts[0] if parts else ""
+    args = parts[1].strip() if len(parts) > 1 else ""
+
+    if verb == 'guess':
+        await handle_guess(session, args)
+    elif verb == 'new' and not args:
+        session.new_game()
+    elif verb == 'giveup' and not args:
+        session.reply(f"Было загадано слово: {session.game.secret_word}\n".encode())
+        session.new_game()
+    elif verb == 'help' and not args:
+        session.reply(HELP)
+    elif verb == 'quit' and not args:
+        session.reply(GOODBYE)
+        session.closing = True
+    else:
+        # Всё остальное считается попыткой, как в локальной игре
+        await handle_guess(session, data.decode(errors='replace').strip())
+
+
+async def play(reader, writer):
+    global connections
+
+    if config.max_connections and connections >= config.max_connections:
+        writer.writelines((SERVER_FULL, END_OF_BLOCK))
+        writer.close()
+        return
+
+    connections += 1
+    session = Session(reader, writer)
+    session.reply(f"Добро пожаловать в «Быки и коровы»! Загадано слово из {config.length} букв.\n"
+                  f"Для просмотра команд введите: help\n".encode())
+
+    try:
+        while not session.closing:
+            try:
+                async with asyncio.timeout(config.idle_timeout or None):
+                    data = await reader.readline()
+            except TimeoutError:
+                session.reply(IDLE_TIMEOUT)
+                break
+            except ValueError:
+                session.reply(LINE_TOO_LONG)
+                break
+
+            if not data:
+                break
+            if data.strip():
+                await handle_command(session, data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        connections -= 1
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def report(interval=60.0):
+    while True:
+        await asyncio.sleep(interval)
+        print(f"Игроков: {connections}, начато игр: {games_started}, угадано: {games_won}")
+
+
+async def serve():
+    global words, encoded, hint_pool, first_hints
+
+    started = time.perf_counter()
+    words = bullscows.load_dictionary(config.dictionary).words(config.length)
+    if not words:
+        raise SystemExit(f"Ошибка: в словаре нет слов длины {config.length}")
+    if config.hints:
+        if np is None:
+            raise SystemExit("Ошибка: для подсказок нужен NumPy")
+        encoded = bullscows.EncodedWords(words)
+        hint_pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.hint_workers)
+        first_hints = functools.lru_cache(maxsize=config.hint_cache)(narrow_all)
+    print(f"Словарь: {len(words)} слов длины {config.length}, загружен за {time.perf_counter() - started:.3f} с")
+
+    server = await asyncio.start_server(play, config.host, config.port, limit=config.max_line,
+                                        backlog=config.backlog)
+    addr = server.sockets[0].getsockname()
+    print(f"Сервер запущен на {addr} (pid {os.getpid()})")
+
+    report_task = asyncio.create_task(report())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        report_task.cancel()
+        if hint_pool is not None:
+            hint_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    if config.dictionary is None:
+        parser.error("укажите словарь")
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    config = parser.parse_args()
+    main()
@@ -0,0 +1,248 @@
+import gzip
+import io
+import itertools
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import bullscows
+from bullscows import np
+
+WORDS = ["кобра", "аббат", "ааааа", "бабка", "карта", "ворон", "норка", "абвгд", "ёжики", "zebra"]
+
+# Догадки, на которых легко ошибиться: повторы букв, буквы не из словаря, другая длина
+GUESSES = ["ааааа", "аббат", "баааб", "ккккк", "щщщщщ", "abcde", "", "а", "кобраааа", "ёжик", "zebra"]
+
+
+@unittest.skipIf(np is None, "нужен NumPy")
+class VectorisedScoringTest(unittest.TestCase):
+    def test_many_matches_scalar(self):
+        encoded = bullscows.EncodedWords(WORDS)
+        for guess in GUESSES + WORDS:
+            bulls, cows = bullscows.bullscows_many(guess, encoded)
+            expected = [bullscows.bullscows(guess, word) for word in WORDS]
+            self.assertEqual(list(zip(bulls.tolist(), cows.tolist())), expected, guess)
+
+    def test_block_matches_scalar(self):
+        # Слова разной длины дополняются нулями, которые не должны давать быков
+        words = WORDS + ["кот", "коробка", "аб"]
+        encoded = bullscows.EncodedWords(words)
+        bulls, cows = bullscows.bullscows_block(range(len(words)), encoded)
+        for (i, guess), (j, word) in itertools.product(enumerate(words), repeat=2):
+            self.assertEqual((bulls[i, j], cows[i, j]), bullscows.bullscows(guess, word), (guess, word))
+
+    def test_block_in_small_chunks(self):
+        encoded = bullscows.EncodedWords(WORDS)
+        whole = bullscows.bullscows_block(range(len(WORDS)), encoded)
+        saved = bullscows.BLOCK_BYTES
+        bullscows.BLOCK_BYTES = 1
+        try:
+            chunked = bullscows.bullscows_block(range(len(WORDS)), encoded)
+        finally:
+            bullscows.BLOCK_BYTES = saved
+        for left, right in zip(whole, chunked):
+            self.assertTrue((left == right).all())
+
+
+def random_words(count, seed):
+    # Маленький алфавит, чтобы ответы были разнообразными, а не сплошь нули
+    generator = random.Random(seed)
+    words = set()
+    while len(words) < count:
+        words.add("".join(generator.choice("абвгдеклмнор") for _ in range(5)))
+    return sorted(words)
+
+
+@unittest.skipIf(np is None, "нужен NumPy")
+class SolverTest(unittest.TestCase):
+    def setUp(self):
+        self.words = random_words(300, 3)
+
+    def test_solves_every_secret(self):
+        for strategy in ("entropy", "minimax", "random"):
+            solver = bullscows.Solver(self.words, strategy, pool_size=64, seed=1)
+            for secret in self.words[::15]:
+                solver.reset()
+                attempts = bullscows.gameplay(solver.ask, solver.inform, self.words, secret)
+                self.assertEqual(solver.last_guess, secret, strategy)
+                self.assertLessEqual(attempts, 12, (strategy, secret))
+
+    def test_candidates_agree_with_answers(self):
+        solver = bullscows.Solver(self.words, pool_size=64, seed=2)
+        secret = self.words[42]
+        moves = []
+        while True:
+            guess = solver.ask("", self.words)
+            bulls, cows = bullscows.bullscows(guess, secret)
+            moves.append((guess, bulls, cows))
+            solver.inform("", bulls, cows)
+            expected = [word for word in self.words
+                        if all(bullscows.bullscows(past, word) == (b, c) for past, b, c in moves)]
+            self.assertEqual([self.words[i] for i in solver.candidates], expected)
+            if bulls == len(secret):
+                break
+
+    def test_guess_outside_dictionary(self):
+        solver = bullscows.Solver(self.words)
+        solver.update("ааааа", *bullscows.bullscows("ааааа", self.words[0]))
+        self.assertIn(0, solver.candidates.tolist())
+
+    def test_feedback_and_opening_are_cached(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            solver = bullscows.Solver(self.words, cache_dir=cache_dir, pool_size=64, seed=4)
+            rows = solver.feedback.rows(range(0, len(self.words), 7))
+            for row, i in zip(rows, range(0, len(self.words), 7)):
+                for j in range(0, len(self.words), 11):
+                    bulls, cows = bullscows.bullscows(self.words[i], self.words[j])
+                    self.assertEqual(row[j], solver.feedback.code(bulls, cows))
+            opening = solver.choose()
+
+            # Другой экземпляр берёт первый ход и готовые строки из кэша
+            again = bullscows.Solver(self.words, cache_dir=cache_dir, pool_size=64, seed=5)
+            self.assertEqual(again.load_opening(), opening)
+            self.assertEqual(again.choose(), opening)
+            self.assertTrue(again.feedback.ready[::7].all())
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            bullscows.Solver(self.words, "greedy")
+
+
+class CompiledDictionaryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "words.dict")
+
+        generator = random.Random(1)
+        alphabet = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+        self.words = {"".join(generator.choice(alphabet) for _ in range(generator.randint(1, 7)))
+                      for _ in range(3000)}
+        bullscows.compile_dictionary(list(self.words) * 2, self.path, {})
+        self.dictionary = bullscows.Dictionary(self.path)
+
+    def test_buckets_are_sorted_unique_words(self):
+        self.assertEqual(self.dictionary.lengths(), sorted({len(word) for word in self.words}))
+        for length in self.dictionary.lengths():
+            expected = sorted(word for word in self.words if len(word) == length)
+            bucket = self.dictionary.words(length)
+            self.assertEqual(len(bucket), len(expected))
+            self.assertEqual(list(bucket), expected)
+            self.assertEqual(bucket[-1], expected[-1])
+            self.assertEqual(bucket[1:4], expected[1:4])
+
+    def test_contains_matches_set(self):
+        generator = random.Random(2)
+        probes = list(self.words) + ["".join(generator.choice("абвгд") for _ in range(generator.randint(0, 8)))
+                                     for _ in range(3000)]
+        probes += ["", "кот" * 3, "a", 5, None]
+        for length in range(0, 9):
+            bucket = self.dictionary.words(length)
+            expected = {word for word in self.words if len(word) == length}
+            for probe in probes:
+                self.assertEqual(probe in bucket, probe in expected, (length, probe))
+
+    @unittest.skipIf(np is None, "нужен NumPy")
+    def test_bucket_codes_match_encoding(self):
+        bucket = self.dictionary.words(5)
+        from_bucket = bullscows.EncodedWords(bucket)
+        from_list = bullscows.EncodedWords(list(bucket))
+        self.assertTrue((from_bucket.codes == from_list.codes).all())
+        self.assertTrue((from_bucket.counts == from_list.counts).all())
+
+
+class StreamingReaderTest(unittest.TestCase):
+    def test_chunk_boundaries_and_gzip(self):
+        text = "  ".join(WORDS * 3) + "\nкобра\tкарта\n"
+        expected = list(dict.fromkeys(word for word in text.split() if len(word) == 5))
+        saved = bullscows.READ_CHUNK
+        bullscows.READ_CHUNK = 3
+        try:
+            for data in (text.encode(), gzip.compress(text.encode())):
+                stream = io.BufferedReader(io.BytesIO(data))
+                self.assertEqual(list(bullscows.iter_words(stream, 5)), expected)
+        finally:
+            bullscows.READ_CHUNK = saved
+
+
+class CandidateTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.words = random_words(300, 6)
+        self.secret = self.words[100]
+        self.moves = [(guess, *bullscows.bullscows(guess, self.secret))
+                      for guess in (self.words[0], "ааааа", self.words[200], self.words[250])]
+
+    def consistent(self, moves):
+        return [word for word in self.words
+                if all(bullscows.bullscows(guess, word) == (b, c) for guess, b, c in moves)]
+
+    def check_updates(self):
+        tracker = bullscows.CandidateTracker(self.words)
+        self.assertEqual(tracker.remaining, len(self.words))
+        for done in range(1, len(self.moves) + 1):
+            remaining = tracker.update(*self.moves[done - 1])
+            expected = self.consistent(self.moves[:done])
+            self.assertEqual(remaining, len(expected))
+            self.assertEqual(tracker.remaining_words(), expected)
+        self.assertIn(self.secret, tracker.remaining_words())
+
+    def test_update_matches_brute_force(self):
+        self.check_updates()
+
+    def test_update_without_numpy(self):
+        with mock.patch.object(bullscows, "np", None):
+            self.check_updates()
+
+    def test_undo(self):
+        tracker = bullscows.CandidateTracker(self.words)
+        with self.assertRaises(IndexError):
+            tracker.undo()
+
+        counts = [tracker.remaining]
+        for move in self.moves:
+            counts.append(tracker.update(*move))
+        for move, count in zip(reversed(self.moves), reversed(counts[:-1])):
+            self.assertEqual(tracker.undo(), move)
+            self.assertEqual(tracker.remaining, count)
+        self.assertEqual(tracker.remaining_words(), self.words)
+
+        # После отката ход можно сыграть иначе
+        tracker.update(*self.moves[1])
+        self.assertEqual(tracker.remaining_words(), self.consistent(self.moves[1:2]))
+
+    def test_snapshot_restore(self):
+        tracker = bullscows.CandidateTracker(self.words)
+        tracker.update(*self.moves[0])
+        snapshot = tracker.snapshot()
+        expected = tracker.remaining_words()
+
+        for move in self.moves[1:]:
+            tracker.update(*move)
+        tracker.restore(snapshot)
+        self.assertEqual(tracker.remaining_words(), expected)
+
+        # Снимок не портится ни новыми ходами, ни откатом после восстановления
+        tracker.update(*self.moves[2])
+        tracker.undo()
+        tracker.undo()
+        tracker.restore(snapshot)
+        self.assertEqual(tracker.remaining_words(), expected)
+        self.assertEqual(tracker.undo(), self.moves[0])
+
+    def test_gameplay_reports_remaining(self):
+        tracker = bullscows.CandidateTracker(self.words)
+        guesses = iter([self.words[0], self.words[200], self.secret])
+        reports = []
+        attempts = bullscows.gameplay(lambda prompt, valid: next(guesses),
+                                      lambda text, bulls, cows: reports.append(text.format(bulls, cows)),
+                                      self.words, self.secret, tracker)
+        self.assertEqual(attempts, 3)
+        self.assertTrue(all("Осталось слов:" in report for report in reports))
+        self.assertTrue(reports[-1].endswith(f"Осталось слов: {tracker.remaining}"))
+        self.assertEqual(tracker.remaining_words(), [self.secret])
+
+
+if __name__ == "__main__":
+    unittest.main()
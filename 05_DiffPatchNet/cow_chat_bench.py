@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+import unicodedata
+
+import cowsay
+
+parser = argparse.ArgumentParser(description='Нагрузочный тест коровьего чат-сервера')
+parser.add_argument('--host', type=str, default='127.0.0.1', help='Адрес сервера')
+parser.add_argument('--port', type=int, default=1337, help='Порт сервера')
+parser.add_argument('--spawn', action='store_true',
+                    help='Запустить локальный сервер с --test-names на время теста')
+parser.add_argument('--server-args', type=str, default='',
+                    help='Дополнительные аргументы запускаемого сервера')
+parser.add_argument('--clients', type=int, default=100, help='Число имитируемых коров')
+parser.add_argument('--connect-concurrency', type=int, default=200,
+                    help='Сколько подключений устанавливать одновременно')
+parser.add_argument('--duration', type=float, default=10.0, help='Длительность нагрузки в секундах')
+parser.add_argument('--rate', type=float, default=1.0, help='Команд в секунду от одной коровы')
+parser.add_argument('--mix', type=str, default='say=6,yield=1,who=3',
+                    help='Веса команд say, yield и who')
+parser.add_argument('--message-size', type=int, default=32, help='Длина текста сообщения')
+parser.add_argument('--output', type=str, default='-', help='Файл для отчёта в JSON (- — stdout)')
+
+# Метка сообщения; после NFKC-нормализации полноширинные символы cowsay становятся обычными
+TOKEN = re.compile(r'#(\d+)#')
+
+# Первые строки ответов на команды; строки рисунков с них никогда не начинаются
+REPLY_PREFIXES = (
+    "Сообщение отправлено",
+    "Зарегистрированные пользователи:",
+    "Нет зарегистрированных пользователей",
+    "Ошибка",
+)
+
+
+def percentiles(samples):
+    """Сводка по задержкам в миллисекундах"""
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def rank(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples) * 1000, 3),
+        "p50": rank(0.50),
+        "p99": rank(0.99),
+        "p999": rank(0.999),
+        "max": round(samples[-1] * 1000, 3),
+    }
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(','):
+        command, _, weight = item.partition('=')
+        if command not in ('say', 'yield', 'who'):
+            raise ValueError(f"Неизвестная команда в смеси: {command}")
+        weights[command] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+class Stats:
+    def __init__(self):
+        self.sent = collections.Counter()
+        self.acked = 0
+        self.command_latency = []
+        self.delivery_latency = []
+        self.messages = {}
+        self.connect_failed = 0
+        self.disconnected = 0
+
+
+class SimulatedCow:
+    """Одна имитируемая корова: отправляет команды и разбирает входящий поток"""
+
+    def __init__(self, name, stats):
+        self.name = name
+        self.stats = stats
+        self.reader = None
+        self.writer = None
+        self.pending = collections.deque()
+
+    async def read_block(self):
+        """Ответ сервера до пустой строки, которой в построчном режиме кончается каждый блок"""
+        lines = []
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                raise ConnectionError("соединение закрыто")
+            if line == b"\n":
+                return b"".join(lines).decode()
+            lines.append(line)
+
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        await self.read_block()
+        self.writer.write(f"login {self.name}\n".encode())
+        await self.writer.drain()
+        reply = await self.read_block()
+        if "успешно" not in reply:
+            raise ConnectionError(reply.strip())
+
+    def send(self, command):
+        self.pending.append(time.perf_counter())
+        self.stats.sent[command.split(maxsplit=1)[0]] += 1
+        self.writer.write(f"{command}\n".encode())
+
+    async def receive(self):
+        try:
+            while True:
+                data = await self.reader.readline()
+                if not data:
+                    break
+                if data == b"\n":
+                    continue
+                now = time.perf_counter()
+                line = data.decode()
+
+                if line.startswith(REPLY_PREFIXES):
+                    if self.pending:
+                        self.stats.command_latency.append(now - self.pending.popleft())
+                        self.stats.acked += 1
+                    continue
+
+                for token in TOKEN.findall(unicodedata.normalize('NFKC', line)):
+                    sent_at = self.stats.messages.get(int(token))
+                    if sent_at is not None:
+                        self.stats.delivery_latency.append(now - sent_at)
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        self.stats.disconnected += 1
+
+    async def drive(self, peers, commands, weights, rate, deadline, message_size):
+        """Открытая модель нагрузки: команды уходят по расписанию, не дожидаясь ответов"""
+        interval = 1.0 / rate
+        next_at = time.perf_counter() + random.random() * interval
+        filler = "x" * max(0, message_size - 10)
+
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_at += interval
+
+            command = random.choices(commands, weights)[0]
+            if command == 'who':
+                self.send("who")
+                continue
+
+            message_id = len(self.stats.messages)
+            self.stats.messages[message_id] = time.perf_counter()
+            if command == 'say':
+                target = random.choice(peers)
+                while target is self and len(peers) > 1:
+                    target = random.choice(peers)
+                self.send(f"say {target.name} #{message_id}# {filler}")
+            else:
+                self.send(f"yield #{message_id}# {filler}")
+
+            await self.writer.drain()
+
+
+async def run(options):
+    commands, weights = parse_mix(options.mix)
+    stats = Stats()
+    cow_names = cowsay.list_cows()
+    cows = [SimulatedCow(f"{cow_names[i % len(cow_names)]}-{i}", stats) for i in range(options.clients)]
+
+    limit = asyncio.Semaphore(options.connect_concurrency)
+
+    async def connect(cow):
+        async with limit:
+            try:
+                await cow.connect(options.host, options.port)
+                return True
+            except (OSError, ConnectionError):
+                stats.connect_failed += 1
+                return False
+
+    started = time.perf_counter()
+    connected = await asyncio.gather(*(connect(cow) for cow in cows))
+    connect_seconds = time.perf_counter() - started
+    cows = [cow for cow, ok in zip(cows, connected) if ok]
+
+    receivers = [asyncio.create_task(cow.receive()) for cow in cows]
+
+    started = time.perf_counter()
+    deadline = started + options.duration
+    await asyncio.gather(*(
+        cow.drive(cows, commands, weights, options.rate, deadline, options.message_size) for cow in cows
+    ))
+    # Даём серверу дослать то, что уже в очередях
+    await asyncio.sleep(1.0)
+    elapsed = time.perf_counter() - started
+
+    for cow in cows:
+        cow.writer.close()
+    for task in receivers:
+        task.cancel()
+    await asyncio.gather(*receivers, return_exceptions=True)
+
+    sent = sum(stats.sent.values())
+    return {
+        "clients": options.clients,
+        "duration": options.duration,
+        "rate_per_client": options.rate,
+        "mix": dict(zip(commands, weights)),
+        "connect": {
+            "connected": len(cows),
+            "failed": stats.connect_failed,
+            "seconds": round(connect_seconds, 3),
+            "per_second": round(len(cows) / connect_seconds, 1) if connect_seconds else None,
+        },
+        "commands": {
+            "sent": dict(stats.sent),
+            "acked": stats.acked,
+            "per_second": round(stats.acked / elapsed, 1),
+            "sent_per_second": round(sent / elapsed, 1),
+            "latency_ms": percentiles(stats.command_latency),
+        },
+        "delivery": {
+            "messages": len(stats.messages),
+            "latency_ms": percentiles(stats.delivery_latency),
+        },
+    }
+
+
+def raise_file_limit():
+    """Тысячи соединений не помещаются в лимит дескрипторов по умолчанию"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def spawn_server(options):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cow_chat_server.py')
+    command = [sys.executable, script, '--host', options.host, '--port', str(options.port),
+               '--test-names'] + options.server_args.split()
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)
+    return server
+
+
+def main():
+    options = parser.parse_args()
+    raise_file_limit()
+
+    server = spawn_server(options) if options.spawn else None
+    try:
+        report = asyncio.run(run(options))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if options.output == '-':
+        print(text)
+    else:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            file.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import os
+
+
+def send(writer, header, payload=b""):
+    """Отправить сообщение шины: строка JSON с заголовком и сырые байты полезной нагрузки"""
+    header["size"] = len(payload)
+    writer.write(json.dumps(header).encode() + b"\n")
+    if payload:
+        writer.write(payload)
+
+
+async def receive(reader):
+    """Прочитать сообщение шины; (None, None), если соединение закрыто"""
+    line = await reader.readline()
+    if not line:
+        return None, None
+    header = json.loads(line)
+    payload = await reader.readexactly(header["size"]) if header["size"] else b""
+    return header, payload
+
+
+class Broker:
+    """Общий реестр имён коров и маршрутизация сообщений между воркерами"""
+
+    def __init__(self):
+        self.owners = {}
+        self.workers = set()
+
+    def publish(self, header):
+        for worker in self.workers:
+            send(worker, dict(header))
+
+    def forget(self, name, worker):
+        if self.owners.get(name) is worker:
+            del self.owners[name]
+            self.publish({"op": "left", "name": name})
+
+    async def handle(self, reader, writer):
+        self.workers.add(writer)
+        send(writer, {"op": "snapshot", "names": list(self.owners)})
+
+        try:
+            while True:
+                header, payload = await receive(reader)
+                if header is None:
+                    break
+
+                op = header["op"]
+                if op == "register":
+                    name = header["name"]
+                    ok = name not in self.owners
+                    if ok:
+                        self.owners[name] = writer
+                        self.publish({"op": "joined", "name": name})
+                    send(writer, {"op": "reply", "id": header["id"], "ok": ok})
+
+                elif op == "unregister":
+                    self.forget(header["name"], writer)
+
+                elif op == "say":
+                    owner = self.owners.get(header["target"])
+                    if owner is not None:
+                        send(owner, header, payload)
+
+                elif op == "yield":
+                    for worker in self.workers:
+                        if worker is not writer:
+                            send(worker, dict(header), payload)
+
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.workers.discard(writer)
+            for name in [name for name, owner in self.owners.items() if owner is writer]:
+                self.forget(name, writer)
+            writer.close()
+
+
+async def serve_broker(path):
+    if os.path.exists(path):
+        os.unlink(path)
+
+    broker = Broker()
+    server = await asyncio.start_unix_server(broker.handle, path)
+    print(f"Брокер запущен на {path}")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def run_broker(path):
+    """Точка входа процесса-брокера"""
+    try:
+        asyncio.run(serve_broker(path))
+    except KeyboardInterrupt:
+        pass
+
+
+class BusClient:
+    """Подключение воркера к брокеру: регистрация имён и пересылка сообщений"""
+
+    def __init__(self, on_say, on_yield, on_joined, on_left, on_lost):
+        self.on_say = on_say
+        self.on_yield = on_yield
+        self.on_joined = on_joined
+        self.on_left = on_left
+        self.on_lost = on_lost
+
+        # Все коровы, зарегистрированные на любом из воркеров, в порядке входа
+        self.names = {}
+
+        self.reader = None
+        self.writer = None
+        self.waiting = {}
+        self.last_id = 0
+        self.task = None
+
+    async def connect(self, path, attempts=50):
+        for attempt in range(attempts):
+            try:
+                self.reader, self.writer = await asyncio.open_unix_connection(path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(0.1)
+
+        header, _ = await receive(self.reader)
+        for name in header["names"]:
+            self.joined(name)
+        self.task = asyncio.create_task(self.listen())
+
+    def joined(self, name):
+        self.names[name] = None
+        self.on_joined(name)
+
+    async def register(self, name):
+        """Занять имя на всех воркерах; False, если оно уже занято"""
+        self.last_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.last_id] = future
+        send(self.writer, {"op": "register", "id": self.last_id, "name": name})
+        await self.writer.drain()
+        return await future
+
+    def unregister(self, name):
+        send(self.writer, {"op": "unregister", "name": name})
+
+    def say(self, target, data):
+        send(self.writer, {"op": "say", "target": target}, data)
+
+    def broadcast(self, data, exclude=None, rooms=None):
+        send(self.writer, {"op": "yield", "exclude": exclude, "rooms": rooms}, data)
+
+    async def listen(self):
+        try:
+            while True:
+                header, payload = await receive(self.reader)
+                if header is None:
+                    break
+
+                op = header["op"]
+                if op == "reply":
+                    self.waiting.pop(header["id"]).set_result(header["ok"])
+                elif op == "joined":
+                    self.joined(header["name"])
+                elif op == "left":
+                    self.names.pop(header["name"], None)
+                    self.on_left(header["name"])
+                elif op == "say":
+                    await self.on_say(header["target"], payload)
+                elif op == "yield":
+                    await self.on_yield(payload, header["exclude"], header["rooms"])
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+
+        print("Соединение с брокером потеряно")
+        for future in self.waiting.values():
+            if not future.done():
+                future.set_result(False)
+        self.waiting.clear()
+        self.on_lost()
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,202 @@
+import mmap
+import os
+import struct
+import time
+
+# Запись сегмента: время постановки, длина, затем сами байты сообщения
+RECORD = struct.Struct("!dI")
+SUFFIX = ".seg"
+
+
+class Mailbox:
+    """Почтовые ящики коров на диске: по каталогу на корову, в нём сегменты только для дозаписи
+
+    Сообщения читаются через mmap в порядке записи, прочитанные сегменты удаляются.
+    Позиция чтения хранится в памяти, поэтому после падения сервера недочитанный
+    сегмент будет доставлен ещё раз целиком — доставка «хотя бы один раз».
+    """
+
+    def __init__(self, root, segment_bytes, max_bytes, max_age):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(root, exist_ok=True)
+
+        # Открытый для дозаписи сегмент: корова -> (номер, файл)
+        self.appending = {}
+        # Позиция чтения: корова -> (номер сегмента, смещение)
+        self.cursors = {}
+
+        self.appended_bytes = 0
+        self.replayed_bytes = 0
+        self.expired_bytes = 0
+
+    def directory(self, cow):
+        return os.path.join(self.root, cow)
+
+    def segments(self, cow):
+        """Номера сегментов коровы по возрастанию"""
+        try:
+            names = os.listdir(self.directory(cow))
+        except FileNotFoundError:
+            return []
+        return sorted(int(name[:-len(SUFFIX)]) for name in names if name.endswith(SUFFIX))
+
+    def path(self, cow, number):
+        return os.path.join(self.directory(cow), f"{number:016d}{SUFFIX}")
+
+    def has_pending(self, cow):
+        return bool(self.segments(cow))
+
+    def append(self, cow, data):
+        """Дописать сообщение в конец последнего сегмента"""
+        number, file = self.appending.get(cow, (None, None))
+
+        # Сегмент мог быть дочитан и удалён, пока был открыт у нас
+        if file is not None and (os.fstat(file.fileno()).st_nlink == 0 or file.tell() >= self.segment_bytes):
+            file.close()
+            file = None
+
+        if file is None:
+            os.makedirs(self.directory(cow), exist_ok=True)
+            segments = self.segments(cow)
+            number = segments[-1] if segments else 1
+            if segments and os.path.getsize(self.path(cow, number)) >= self.segment_bytes:
+                number += 1
+            file = open(self.path(cow, number), 'ab', buffering=0)
+            self.appending[cow] = (number, file)
+
+        # Одна запись одним write, чтобы воркеры могли дописывать в тот же файл
+        file.write(RECORD.pack(time.time(), len(data)) + data)
+        self.appended_bytes += len(data)
+
+        if file.tell() >= self.segment_bytes:
+            self.prune(cow)
+
+    def prepend(self, cow, batch):
+        """Положить сообщения перед всеми, что уже лежат в ящике
+
+        Они пишутся в новый сегмент с номером меньше первого. Позиция чтения
+        сбрасывается, и частично прочитанный сегмент будет доставлен заново —
+        та же доставка «хотя бы один раз».
+        """
+        segments = self.segments(cow)
+        if not segments:
+            for data in batch:
+                self.append(cow, data)
+            return
+
+        os.makedirs(self.directory(cow), exist_ok=True)
+        now = time.time()
+        with open(self.path(cow, segments[0] - 1), 'wb') as file:
+            file.write(b"".join(RECORD.pack(now, len(data)) + data for data in batch))
+        self.appended_bytes += sum(map(len, batch))
+        self.cursors.pop(cow, None)
+
+    def prune(self, cow):
+        """Удалить самые старые сегменты сверх лимита по объёму или возрасту
+
+        Последний сегмент остаётся ради лимита по объёму, но удаляется, если в него
+        давно ничего не дописывали: тогда все его записи уже просрочены.
+        """
+        segments = self.segments(cow)
+        try:
+            stats = {number: os.stat(self.path(cow, number)) for number in segments}
+        except FileNotFoundError:
+            # Сегмент удалил другой воркер, разберёмся в следующий раз
+            return
+        total = sum(stat.st_size for stat in stats.values())
+        expired = time.time() - self.max_age
+
+        for number in segments:
+            stat = stats[number]
+            if stat.st_mtime >= expired and (total <= self.max_bytes or number == segments[-1]):
+                break
+            appending = self.appending.get(cow)
+            if appending is not None and appending[0] == number:
+                appending[1].close()
+                del self.appending[cow]
+            try:
+                os.unlink(self.path(cow, number))
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+            self.expired_bytes += stat.st_size
+            if self.cursors.get(cow, (0, 0))[0] == number:
+                del self.cursors[cow]
+
+        if not self.segments(cow):
+            try:
+                os.rmdir(self.directory(cow))
+            except OSError:
+                pass
+
+    def sweep(self):
+        """Применить лимиты ко всем ящикам, в том числе тех коров, что больше не приходят"""
+        try:
+            cows = os.listdir(self.root)
+        except FileNotFoundError:
+            return
+        for cow in cows:
+            if os.path.isdir(self.directory(cow)):
+                self.prune(cow)
+
+    def read(self, cow, max_bytes):
+        """Следующая пачка сообщений не больше max_bytes; пустой список — ящик пуст"""
+        batch = []
+        size = 0
+        expired = time.time() - self.max_age
+
+        while size < max_bytes:
+            segments = self.segments(cow)
+            if not segments:
+                break
+
+            number, offset = self.cursors.get(cow, (segments[0], 0))
+            if number not in segments:
+                number, offset = segments[0], 0
+
+            path = self.path(cow, number)
+            with open(path, 'rb') as file:
+                length = os.fstat(file.fileno()).st_size
+                if offset < length:
+                    with mmap.mmap(file.fileno(), length, access=mmap.ACCESS_READ) as view:
+                        while offset + RECORD.size <= length and size < max_bytes:
+                            stamp, record_size = RECORD.unpack_from(view, offset)
+                            end = offset + RECORD.size + record_size
+                            if end > length:
+                                # Запись ещё дописывается другим процессом
+                                break
+                            if stamp >= expired:
+                                batch.append(view[offset + RECORD.size:end])
+                                size += record_size
+                            else:
+                                self.expired_bytes += record_size
+                            offset = end
+
+            self.cursors[cow] = (number, offset)
+            if offset < length:
+                break
+
+            # Сегмент дочитан: удаляем его и идём к следующему
+            self.forget_segment(cow, number, path)
+            if number == segments[-1]:
+                break
+
+        self.replayed_bytes += size
+        return batch
+
+    def forget_segment(self, cow, number, path):
+        appending = self.appending.get(cow)
+        if appending is not None and appending[0] == number:
+            appending[1].close()
+            del self.appending[cow]
+        os.unlink(path)
+        self.cursors.pop(cow, None)
+
+    def close(self, cow):
+        """Закрыть открытый сегмент коровы, когда она ушла или ящик дочитан"""
+        appending = self.appending.pop(cow, None)
+        if appending is not None:
+            appending[1].close()
@@ -0,0 +1,175 @@
+import asyncio
+import bisect
+import collections
+import json
+import time
+
+# Границы корзин гистограмм задержек в секундах
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COMMANDS = ('login', 'say', 'yield', 'who', 'cows', 'help', 'join', 'leave', 'rooms',
+            'admin', 'broadcast', 'proto', 'quit', 'unknown')
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        result = []
+        running = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            running += count
+            result.append((bound, running))
+        return result
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "buckets": {("+Inf" if bound == float('inf') else str(bound)): count
+                        for bound, count in self.cumulative()},
+        }
+
+
+class Metrics:
+    """Счётчики и гистограммы сервера; очереди клиентов опрашиваются в момент съёма"""
+
+    def __init__(self):
+        self.commands = collections.Counter()
+        self.command_latency = {command: Histogram() for command in COMMANDS}
+        self.render_latency = Histogram()
+        self.loop_lag = Histogram()
+        self.loop_lag_max = 0.0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections = 0
+        self.connections_total = 0
+
+        # Срабатывания защит: отказы в соединении, таймауты, превышение частоты и длины
+        self.limits = collections.Counter()
+        self.started = time.time()
+
+        # Функции, которые сервер подставляет для съёма: {корова: (глубина, пик, байт)}
+        # и дополнительные числовые показатели вроде попаданий в кэш отрисовки
+        self.queues = dict
+        self.gauges = dict
+
+    def command_done(self, command, started):
+        if command not in self.command_latency:
+            command = 'unknown'
+        self.commands[command] += 1
+        self.command_latency[command].observe(time.perf_counter() - started)
+
+    async def watch_loop_lag(self, interval=0.5):
+        """Задержка пробуждения спящей задачи — насколько цикл событий не успевает"""
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.loop_lag.observe(lag)
+            self.loop_lag_max = max(self.loop_lag_max, lag)
+
+    def snapshot(self):
+        queues = self.queues()
+        result = {
+            "uptime": time.time() - self.started,
+            "connections": self.connections,
+            "connections_total": self.connections_total,
+            "registered": len(queues),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "limits": dict(self.limits),
+            "commands": {command: {"count": self.commands[command],
+                                   "latency": self.command_latency[command].as_dict()}
+                         for command in COMMANDS},
+            "render_latency": self.render_latency.as_dict(),
+            "loop_lag": dict(self.loop_lag.as_dict(), max=self.loop_lag_max),
+            "queues": {name: {"depth": depth, "peak": peak, "bytes": size}
+                       for name, (depth, peak, size) in queues.items()},
+        }
+        result.update(self.gauges())
+        return result
+
+    def prometheus(self):
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in histograms:
+                prefix = ",".join(f'{key}="{value}"' for key, value in labels)
+                separator = "," if prefix else ""
+                for bound, count in hist.cumulative():
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{{prefix}{separator}le="{le}"}} {count}')
+                suffix = f"{{{prefix}}}" if prefix else ""
+                lines.append(f"{name}_sum{suffix} {hist.total}")
+                lines.append(f"{name}_count{suffix} {hist.count}")
+
+        def gauge(name, help_text, kind, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                suffix = "{" + ",".join(f'{key}="{label}"' for key, label in labels) + "}" if labels else ""
+                lines.append(f"{name}{suffix} {value}")
+
+        queues = self.queues()
+        gauge("cowchat_connections", "Открытые соединения", "gauge", [((), self.connections)])
+        gauge("cowchat_connections_total", "Принятые соединения", "counter", [((), self.connections_total)])
+        gauge("cowchat_registered", "Зарегистрированные коровы", "gauge", [((), len(queues))])
+        gauge("cowchat_bytes_in_total", "Принято байт", "counter", [((), self.bytes_in)])
+        gauge("cowchat_bytes_out_total", "Отправлено байт", "counter", [((), self.bytes_out)])
+        gauge("cowchat_limited_total", "Срабатывания защит сервера", "counter",
+              [((("reason", reason),), count) for reason, count in sorted(self.limits.items())])
+        gauge("cowchat_commands_total", "Обработано команд", "counter",
+              [((("command", command),), self.commands[command]) for command in COMMANDS])
+        histogram("cowchat_command_seconds", "Время обработки команды",
+                  [((("command", command),), self.command_latency[command]) for command in COMMANDS])
+        histogram("cowchat_render_seconds", "Время отрисовки сообщения", [((), self.render_latency)])
+        histogram("cowchat_loop_lag_seconds", "Задержка цикла событий", [((), self.loop_lag)])
+        gauge("cowchat_queue_depth", "Сообщений в очереди коровы", "gauge",
+              [((("cow", name),), depth) for name, (depth, _, _) in queues.items()])
+        gauge("cowchat_queue_peak", "Пиковая глубина очереди коровы", "gauge",
+              [((("cow", name),), peak) for name, (_, peak, _) in queues.items()])
+        gauge("cowchat_queue_bytes", "Байт в очереди коровы", "gauge",
+              [((("cow", name),), size) for name, (_, _, size) in queues.items()])
+        for name, value in self.gauges().items():
+            gauge(f"cowchat_{name}", name, "gauge", [((), value)])
+        return "\n".join(lines) + "\n"
+
+    async def serve_stats(self, reader, writer):
+        """Минимальный HTTP: /metrics — формат Prometheus, всё остальное — JSON"""
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request.decode(errors='replace').split()
+            path = parts[1] if len(parts) > 1 else '/'
+
+            if path.startswith('/metrics'):
+                body = self.prometheus().encode()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                body = json.dumps(self.snapshot(), ensure_ascii=False).encode()
+                content_type = "application/json; charset=utf-8"
+
+            writer.write(
+                f"HTTP/1.0 200 OK\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -1,190 +1,1161 @@
+import argparse
 import asyncio
+import bisect
+import collections
+import concurrent.futures
 import cowsay
+import json
+import multiprocessing
+import os
+import struct
+import tempfile
+import time
+
+import cow_chat_bus
+import cow_chat_mailbox
+import cow_chat_metrics
+
+parser = argparse.ArgumentParser(description='Коровий чат-сервер')
+parser.add_argument('--host', type=str, default='0.0.0.0', help='Адрес, на котором слушает сервер')
+parser.add_argument('--port', type=int, default=1337, help='Порт сервера')
+parser.add_argument('--backlog', type=int, default=1024,
+                    help='Длина очереди входящих соединений')
+parser.add_argument('--workers', type=int, default=1,
+                    help='Число процессов, принимающих соединения на одном порту (SO_REUSEPORT)')
+parser.add_argument('--bus-path', type=str, default=None,
+                    help='Unix-сокет брокера, через который воркеры делят реестр и сообщения')
+parser.add_argument('--test-names', action='store_true',
+                    help='Разрешить имена вида <корова>-<число> для нагрузочного тестирования')
+parser.add_argument('--default-room', type=str, default='all',
+                    help='Комната, в которую корова попадает при входе (пустая строка — никакая)')
+parser.add_argument('--admin-token', type=str, default=None,
+                    help='Пароль для команды admin; без него рассылка всем недоступна')
+parser.add_argument('--max-connections', type=int, default=10000,
+                    help='Максимальное число одновременных соединений (0 — без ограничения)')
+parser.add_argument('--login-timeout', type=float, default=0.0,
+                    help='Сколько секунд ждать login от нового соединения (0 — без ограничения)')
+parser.add_argument('--idle-timeout', type=float, default=0.0,
+                    help='Через сколько секунд без команд от клиента закрывать соединение (0 — никогда)')
+parser.add_argument('--max-line', type=int, default=64 * 1024,
+                    help='Максимальная длина команды в байтах')
+parser.add_argument('--rate-limit', type=float, default=0.0,
+                    help='Сколько say/yield в секунду разрешено одной корове (0 — без ограничения)')
+parser.add_argument('--rate-burst', type=int, default=0,
+                    help='Сколько say/yield корова может послать разом сверх скорости '
+                         '(0 — столько же, сколько разрешено в секунду)')
+parser.add_argument('--stats-port', type=int, default=0,
+                    help='Локальный порт статистики: /metrics (Prometheus) и /stats (JSON); 0 — выключено')
+parser.add_argument('--queue-messages', type=int, default=256,
+                    help='Максимальное число сообщений в очереди одного клиента')
+parser.add_argument('--queue-bytes', type=int, default=1 << 20,
+                    help='Максимальный объём очереди одного клиента в байтах')
+parser.add_argument('--queue-policy', choices=('drop-oldest', 'drop-newest', 'disconnect', 'spill'),
+                    default='drop-oldest',
+                    help='Что делать при переполнении очереди медленного клиента (spill — сбрасывать на диск)')
+parser.add_argument('--queue-grace', type=float, default=5.0,
+                    help='Через сколько секунд переполнения отключать клиента (политика disconnect)')
+parser.add_argument('--mailbox-dir', type=str, default=None,
+                    help='Каталог почтовых ящиков для сообщений коровам не в сети (по умолчанию выключено)')
+parser.add_argument('--mailbox-segment', type=int, default=1 << 20,
+                    help='Размер сегмента почтового ящика в байтах')
+parser.add_argument('--mailbox-max-bytes', type=int, default=64 << 20,
+                    help='Максимальный объём почтового ящика одной коровы в байтах')
+parser.add_argument('--mailbox-max-age', type=float, default=7 * 24 * 3600,
+                    help='Сколько секунд хранить недоставленные сообщения')
+parser.add_argument('--mailbox-sweep', type=float, default=600.0,
+                    help='Как часто в секундах применять лимиты ко всем почтовым ящикам')
+parser.add_argument('--render-cache', type=int, default=1024,
+                    help='Сколько отрисованных сообщений хранить в кэше (0 — не кэшировать)')
+parser.add_argument('--render-workers', type=int, default=0,
+                    help='Число воркеров для отрисовки сообщений (0 — рисовать в цикле событий)')
+parser.add_argument('--render-executor', choices=('process', 'thread'), default='process',
+                    help='Пул для отрисовки: процессы или потоки')
+parser.add_argument('--render-queue', type=int, default=1024,
+                    help='Максимальное число сообщений, ожидающих отрисовки')
+parser.add_argument('--render-batch', type=int, default=32,
+                    help='Сколько сообщений отрисовывать за одно обращение к пулу')
+
+config = parser.parse_args([])
+
+# Кадр протокола framed: тип, номер запроса, длина полезной нагрузки
+FRAME = struct.Struct("!BII")
+REQUEST, REPLY, PUSH = 1, 2, 3
+
+# Сообщение без рисунка для клиентов с возможностью raw: префикс и JSON в одной строке
+RAW_PREFIX = b"@msg "
+
+# Изменения состава чата для подписчиков proto presence: "+имя" или "-имя" в одной строке;
+# "off" — сервер отписал клиента, и тот должен снова опрашивать who сам
+PRESENCE_PREFIX = b"@presence "
+PRESENCE_OFF = PRESENCE_PREFIX + b"off\n"
+
+# В построчном режиме каждый ответ и каждый рисунок завершаются пустой строкой,
+# чтобы клиент мог собрать многострочный ответ, не угадывая, где он кончился
+END_OF_BLOCK = b"\n"
+
+# Постоянные ответы кодируются один раз при запуске
+WELCOME = (
+    "Добро пожаловать в коровий чат!\n"
+    "Для регистрации введите: login <название_коровы>\n"
+    "Для просмотра команд введите: help\n"
+).encode()
+HELP = (
+    "Доступные команды:\n"
+    "- who — просмотр зарегистрированных пользователей\n"
+    "- cows — просмотр свободных имён коров\n"
+    "- login <название_коровы> — зарегистрироваться под именем коровы\n"
+    "- say <название_коровы> <текст сообщения> — послать сообщение пользователю\n"
+    "- yield <текст сообщения> — послать сообщение всем в своих комнатах\n"
+    "- join <комната> — войти в комнату\n"
+    "- leave <комната> — выйти из комнаты\n"
+    "- rooms — список комнат (с несколькими воркерами — участники на этом воркере)\n"
+    "- admin <пароль> — получить права администратора\n"
+    "- broadcast <текст сообщения> — послать сообщение всем на сервере (для администратора)\n"
+    "- proto framed — перейти на кадровый протокол с номерами запросов\n"
+    "- proto raw — получать сообщения без рисунка, чтобы рисовать их у себя\n"
+    "- proto presence — получать уведомления о входе и выходе коров\n"
+    "- quit — отключиться\n"
+    "- help — показать это сообщение\n"
+).encode()
+NO_USERS = "Нет зарегистрированных пользователей\n".encode()
+YIELD_SENT = "Сообщение отправлено всем пользователям\n".encode()
+FRAMED = "Протокол: framed\n".encode()
+RAW = "Протокол: raw\n".encode()
+PRESENCE = "Протокол: presence\n".encode()
+GOODBYE = "До свидания!\n".encode()
+LOGIN_USAGE = "Ошибка: Используйте 'login <название_коровы>'\n".encode()
+SAY_USAGE = "Ошибка: Используйте 'say <название_коровы> <текст сообщения>'\n".encode()
+YIELD_USAGE = "Ошибка: Используйте 'yield <текст сообщения>'\n".encode()
+LOGIN_FIRST = "Ошибка: Сначала зарегистрируйтесь с помощью 'login <название_коровы>'\n".encode()
+JOIN_USAGE = "Ошибка: Используйте 'join <комната>'\n".encode()
+LEAVE_USAGE = "Ошибка: Используйте 'leave <комната>'\n".encode()
+BROADCAST_USAGE = "Ошибка: Используйте 'broadcast <текст сообщения>'\n".encode()
+NO_ROOMS = "Ошибка: Вы не состоите ни в одной комнате, используйте 'join <комната>'\n".encode()
+ADMIN_ONLY = "Ошибка: Команда доступна только администратору\n".encode()
+ADMIN_OK = "Вы получили права администратора\n".encode()
+ADMIN_DENIED = "Ошибка: Неверный пароль\n".encode()
+BROADCAST_SENT = "Сообщение отправлено всем на сервере\n".encode()
+UNKNOWN_COMMAND = "Ошибка: Неизвестная команда. Введите 'help' для списка команд\n".encode()
+SERVER_FULL = "Ошибка: Сервер переполнен, попробуйте позже\n".encode()
+LOGIN_TIMEOUT = "Ошибка: Время на регистрацию истекло\n".encode()
+IDLE_TIMEOUT = "Соединение закрыто из-за неактивности\n".encode()
+LINE_TOO_LONG = "Ошибка: Слишком длинная команда\n".encode()
+BAD_ENCODING = "Ошибка: Команда должна быть в кодировке UTF-8\n".encode()
+RATE_LIMITED = "Ошибка: Слишком много сообщений, подождите немного\n".encode()
+OVERLOADED = "Ошибка: Сервер перегружен, попробуйте позже\n".encode()
 
 clients = {}
 
+# Комнаты: имя -> участники с этого воркера (dict как упорядоченное множество)
+rooms = {}
+
 connections = {}
 
+senders = {}
 
-async def chat(reader, writer):
-    addr = "{}:{}".format(*writer.get_extra_info('peername'))
-    print(f"Подключен новый клиент: {addr}")
+# Сессии, подписанные на вход и выход коров (dict как упорядоченное множество)
+watchers = {}
 
-    welcome_message = (
-        "Добро пожаловать в коровий чат!\n"
-        "Для регистрации введите: login <название_коровы>\n"
-        "Для просмотра команд введите: help\n"
-    )
-    writer.write(welcome_message.encode())
-    await writer.drain()
+bus = None
 
-    cow_name = None
+mailbox = None
 
-    while not reader.at_eof():
-        data = await reader.readline()
-        if not data:
-            break
+metrics = cow_chat_metrics.Metrics()
 
-        message = data.decode().strip()
 
-        if message.startswith("login"):
-            parts = message.split(maxsplit=1)
-            if len(parts) != 2:
-                writer.write("Ошибка: Используйте 'login <название_коровы>'\n".encode())
-                await writer.drain()
-                continue
+class CowCatalog:
+    """Каталог коров: загружается один раз, свободные имена хранятся отсортированными"""
 
-            requested_name = parts[1]
+    def __init__(self):
+        self.all = frozenset(cowsay.list_cows())
+        self.free = sorted(self.all)
+        self.free_response = None
 
-            if requested_name not in cowsay.list_cows():
-                writer.write(f"Ошибка: Корова '{requested_name}' не существует\n".encode())
-                await writer.drain()
-                continue
+    def __contains__(self, name):
+        return self.cowfile(name) is not None
 
-            if requested_name in clients:
-                writer.write(f"Ошибка: Имя '{requested_name}' уже занято\n".encode())
-                await writer.drain()
-                continue
+    def cowfile(self, name):
+        """Корова, которой рисуется имя; в тестовом режиме к имени можно добавить -<число>"""
+        if name in self.all:
+            return name
+        if config.test_names:
+            base, _, suffix = name.rpartition('-')
+            if suffix.isdigit() and base in self.all:
+                return base
+        return None
 
-            cow_name = requested_name
-            clients[cow_name] = asyncio.Queue()
-            connections[cow_name] = (reader, writer)
-
-            writer.write(f"Вы успешно зарегистрировались как '{cow_name}'\n".encode())
-            await writer.drain()
-
-        elif message == "help":
-            help_message = (
-                "Доступные команды:\n"
-                "- who — просмотр зарегистрированных пользователей\n"
-                "- cows — просмотр свободных имён коров\n"
-                "- login <название_коровы> — зарегистрироваться под именем коровы\n"
-                "- say <название_коровы> <текст сообщения> — послать сообщение пользователю\n"
-                "- yield <текст сообщения> — послать сообщение всем пользователям\n"
-                "- quit — отключиться\n"
-                "- help — показать это сообщение\n"
-            )
-            writer.write(help_message.encode())
-            await writer.drain()
-        elif message == "who":
-            if not clients:
-                response = "Нет зарегистрированных пользователей\n"
-            else:
-                response = "Зарегистрированные пользователи:\n"
-                for name in clients.keys():
-                    response += f"- {name}\n"
-            writer.write(response.encode())
-            await writer.drain()
-
-        elif message == "cows":
-            all_cows = set(cowsay.list_cows())
-            used_cows = set(clients.keys())
-            free_cows = all_cows - used_cows
-
-            if not free_cows:
+    def take(self, name):
+        index = bisect.bisect_left(self.free, name)
+        if index < len(self.free) and self.free[index] == name:
+            del self.free[index]
+            self.free_response = None
+
+    def release(self, name):
+        if name in self.all:
+            bisect.insort(self.free, name)
+            self.free_response = None
+
+    def free_cows_response(self):
+        """Ответ на команду cows, пересобирается только после login/logout"""
+        if self.free_response is None:
+            if not self.free:
                 response = "Все коровы заняты\n"
             else:
-                response = "Свободные коровы:\n"
-                for cow in sorted(free_cows):
-                    response += f"- {cow}\n"
-
-            writer.write(response.encode())
-            await writer.drain()
-        elif message.startswith("say"):
-            if not cow_name:
-                writer.write("Ошибка: Сначала зарегистрируйтесь с помощью 'login <название_коровы>'\n".encode())
-                await writer.drain()
-                continue
+                response = "Свободные коровы:\n" + "".join(f"- {cow}\n" for cow in self.free)
+            self.free_response = response.encode()
+        return self.free_response
 
-            parts = message.split(maxsplit=2)
-            if len(parts) != 3:
-                writer.write("Ошибка: Используйте 'say <название_коровы> <текст сообщения>'\n".encode())
-                await writer.drain()
-                continue
 
-            target_cow = parts[1]
-            msg_text = parts[2]
+def render_batch(jobs):
+    """Отрисовать пачку сообщений; выполняется в пуле воркеров"""
+    return [encode_message(cowsay.cowsay(text, cow=cow)) for cow, text in jobs]
 
-            if target_cow not in clients:
-                writer.write(f"Ошибка: Пользователь '{target_cow}' не найден\n".encode())
-                await writer.drain()
-                continue
 
-            cow_message = cowsay.cowsay(f"От {cow_name}: {msg_text}", cow=cow_name)
-            await clients[target_cow].put(cow_message)
+class RenderPool:
+    """Пакетная отрисовка сообщений в пуле потоков или процессов"""
 
-            writer.write(f"Сообщение отправлено пользователю '{target_cow}'\n".encode())
-            await writer.drain()
+    def __init__(self, executor):
+        self.executor = executor
+        self.pending = []
+        self.queued = 0
+        self.flush_scheduled = False
 
-        elif message.startswith("yield"):
-            if not cow_name:
-                writer.write("Ошибка: Сначала зарегистрируйтесь с помощью 'login <название_коровы>'\n".encode())
-                await writer.drain()
+    def submit(self, cow, text):
+        """Поставить сообщение в очередь на отрисовку; None, если очередь заполнена"""
+        if self.queued >= config.render_queue:
+            return None
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append(((cow, text), future))
+        self.queued += 1
+
+        # Всё, что пришло за одну итерацию цикла событий, уходит в пул пачками
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            loop.call_soon(self.flush)
+        return future
+
+    def flush(self):
+        self.flush_scheduled = False
+        pending, self.pending = self.pending, []
+        loop = asyncio.get_running_loop()
+
+        for start in range(0, len(pending), config.render_batch):
+            chunk = pending[start:start + config.render_batch]
+            job = loop.run_in_executor(self.executor, render_batch, [key for key, _ in chunk])
+            job.add_done_callback(lambda job, chunk=chunk: self.finish(chunk, job))
+
+    def finish(self, chunk, job):
+        self.queued -= len(chunk)
+        error = job.exception()
+        results = job.result() if error is None else [None] * len(chunk)
+        for (_, future), data in zip(chunk, results):
+            if future.done():
                 continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(data)
 
-            parts = message.split(maxsplit=1)
-            if len(parts) != 2:
-                writer.write("Ошибка: Используйте 'yield <текст сообщения>'\n".encode())
-                await writer.drain()
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RenderCache:
+    """LRU-кэш готовых к отправке сообщений, ключ — (корова, текст)"""
+
+    def __init__(self):
+        self.items = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.pool = None
+
+    async def render(self, cow, text):
+        """Отрисованное сообщение или None, если пул отрисовки перегружен"""
+        key = (cow, text)
+        data = self.items.get(key)
+        if data is not None:
+            self.hits += 1
+            self.items.move_to_end(key)
+            return data
+
+        self.misses += 1
+        started = time.perf_counter()
+        if self.pool is None:
+            data = encode_message(cowsay.cowsay(text, cow=cow))
+        else:
+            future = self.pool.submit(cow, text)
+            if future is None:
+                return None
+            data = await future
+        metrics.render_latency.observe(time.perf_counter() - started)
+
+        if config.render_cache > 0:
+            self.items[key] = data
+            while len(self.items) > config.render_cache:
+                self.items.popitem(last=False)
+        return data
+
+
+catalog = CowCatalog()
+
+render_cache = RenderCache()
+
+
+class Message:
+    """Сообщение коровы: raw-вид кодируется сразу, рисунок — только если есть кому его показать"""
+
+    CAPTIONS = {
+        'say': "От {cow}: {text}",
+        'yield': "От {cow} всем: {text}",
+        'broadcast': "Всем от администратора: {text}",
+    }
+
+    def __init__(self, cow_name, kind, text, raw=None):
+        self.cow_name = cow_name
+        self.kind = kind
+        self.text = text
+        self.art = None
+        if raw is None:
+            fields = {"cow": cow_name, "kind": kind, "mode": "say", "text": text}
+            raw = RAW_PREFIX + json.dumps(fields, ensure_ascii=False).encode() + b"\n"
+        self.raw = raw
+
+    @classmethod
+    def from_raw(cls, raw):
+        """Сообщение, пришедшее от другого воркера; буфер raw используется как есть"""
+        fields = json.loads(raw[len(RAW_PREFIX):])
+        return cls(fields["cow"], fields["kind"], fields["text"], raw)
+
+    async def render(self):
+        """Рисунок сообщения; None, если пул отрисовки перегружен"""
+        if self.art is None:
+            caption = self.CAPTIONS[self.kind].format(cow=self.cow_name, text=self.text)
+            self.art = await render_cache.render(catalog.cowfile(self.cow_name) or 'default', caption)
+        return self.art
+
+
+class Outbox:
+    """Ограниченная очередь исходящих сообщений одного клиента"""
+
+    def __init__(self, cow_name, session):
+        self.cow_name = cow_name
+        self.session = session
+        self.writer = session.writer
+        self.messages = collections.deque()
+        self.ready = asyncio.Event()
+        self.overflow_timer = None
+        self.peak = 0
+
+        # Часть сообщений лежит в почтовом ящике на диске; пока он не дочитан,
+        # новые сообщения тоже пишутся туда, чтобы не нарушить порядок
+        self.spilled = mailbox is not None and mailbox.has_pending(cow_name)
+        if self.spilled:
+            self.ready.set()
+
+        # Учёт байтов: сколько ждёт отправки, сколько отправлено и сколько отброшено
+        self.queued_bytes = 0
+        self.sent_bytes = 0
+        self.dropped_bytes = 0
+        self.dropped = 0
+
+    def overflowing(self):
+        return len(self.messages) > config.queue_messages or self.queued_bytes > config.queue_bytes
+
+    def payload(self, message):
+        return message.raw if self.session.raw else message.art
+
+    def put(self, data):
+        """Поставить закодированное сообщение в очередь, не блокируя отправителя"""
+        full = (len(self.messages) >= config.queue_messages
+                or self.queued_bytes + len(data) > config.queue_bytes)
+
+        if self.spilled or (config.queue_policy == 'spill' and full):
+            mailbox.append(self.cow_name, data)
+            self.spilled = True
+            self.ready.set()
+            return True
+
+        if config.queue_policy == 'drop-newest' and full:
+            self.dropped += 1
+            self.dropped_bytes += len(data)
+            return False
+
+        self.messages.append(data)
+        self.queued_bytes += len(data)
+        self.peak = max(self.peak, len(self.messages))
+
+        if config.queue_policy == 'drop-oldest':
+            while self.overflowing() and len(self.messages) > 1:
+                old = self.messages.popleft()
+                self.queued_bytes -= len(old)
+                self.dropped += 1
+                self.dropped_bytes += len(old)
+        elif config.queue_policy == 'disconnect' and self.overflowing() and self.overflow_timer is None:
+            loop = asyncio.get_running_loop()
+            self.overflow_timer = loop.call_later(config.queue_grace, self.disconnect_slow)
+
+        self.ready.set()
+        return True
+
+    def disconnect_slow(self):
+        self.overflow_timer = None
+        if self.overflowing():
+            print(f"Клиент {self.cow_name} не успевает читать сообщения, отключаем")
+            self.writer.transport.abort()
+
+    async def get_batch(self):
+        """Дождаться сообщений и забрать все накопившиеся: сначала из памяти, потом с диска"""
+        while True:
+            await self.ready.wait()
+            if self.messages:
+                batch = list(self.messages)
+                self.messages.clear()
+                self.queued_bytes = 0
+            elif self.spilled:
+                batch = await self.replayable(mailbox.read(self.cow_name, config.queue_bytes))
+                if not batch:
+                    self.spilled = False
+                    mailbox.close(self.cow_name)
+            else:
+                batch = []
+
+            if not self.spilled:
+                self.ready.clear()
+            if self.overflow_timer is not None:
+                self.overflow_timer.cancel()
+                self.overflow_timer = None
+            if batch:
+                return batch
+
+    async def replayable(self, batch):
+        """Записи ящика в том виде, который понимает клиент
+
+        При сбросе на диск клиенту raw пишется JSON, а корова может вернуться обычным
+        клиентом — такие записи рисуются при чтении. Рисунки годятся любому клиенту.
+        """
+        if self.session.raw:
+            return batch
+        result = []
+        for data in batch:
+            if bytes(data[:len(RAW_PREFIX)]) != RAW_PREFIX:
+                result.append(data)
                 continue
+            message = Message.from_raw(bytes(data))
+            # Пул отрисовки перегружен ненадолго; ждёт только доставка этой коровы
+            while await message.render() is None:
+                await asyncio.sleep(0.1)
+            result.append(message.art)
+        return result
 
-            msg_text = parts[1]
-            cow_message = cowsay.cowsay(f"От {cow_name} всем: {msg_text}", cow=cow_name)
-            for name, queue in clients.items():
-                if name != cow_name:
-                    await queue.put(cow_message)
-            writer.write("Сообщение отправлено всем пользователям\n".encode())
-            await writer.drain()
-
-        elif message == "quit":
-            writer.write("До свидания!\n".encode())
-            await writer.drain()
-            break
+    def close(self):
+        """Корова ушла: недоставленное из памяти уходит в почтовый ящик, если он есть"""
+        if self.overflow_timer is not None:
+            self.overflow_timer.cancel()
+            self.overflow_timer = None
+        if mailbox is not None:
+            if self.messages:
+                # Сброшенное на диск новее того, что ещё в памяти, поэтому память — в начало
+                if self.spilled:
+                    mailbox.prepend(self.cow_name, list(self.messages))
+                else:
+                    for data in self.messages:
+                        mailbox.append(self.cow_name, data)
+                self.messages.clear()
+                self.queued_bytes = 0
+            mailbox.close(self.cow_name)
+
+
+class TokenBucket:
+    """Ограничение частоты: rate жетонов в секунду, не больше burst про запас"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Session:
+    """Одно подключение: построчный протокол или кадры с номерами запросов"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.framed = False
+        self.request_id = 0
+        self.cow_name = None
+        self.closing = False
+        self.rooms = set()
+        self.admin = False
+        self.raw = False
+        self.presence = False
+        self.bucket = TokenBucket(config.rate_limit, config.rate_burst or max(1, config.rate_limit)) \
+            if config.rate_limit > 0 else None
+        self.connected_at = asyncio.get_running_loop().time()
+
+    def deadline(self):
+        """Момент, к которому должна прийти следующая команда, или None"""
+        deadlines = []
+        if self.cow_name is None and config.login_timeout > 0:
+            deadlines.append(self.connected_at + config.login_timeout)
+        if config.idle_timeout > 0:
+            deadlines.append(asyncio.get_running_loop().time() + config.idle_timeout)
+        return min(deadlines, default=None)
+
+    async def read_command(self):
+        """Следующая команда клиента в байтах; None, если соединение закрыто
+
+        Слишком длинная команда вызывает ValueError: в построчном режиме
+        её выбрасывает сам StreamReader, упёршийся в limit.
+        """
+        try:
+            if not self.framed:
+                return await self.reader.readline() or None
+            kind, request_id, size = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+            if size > config.max_line:
+                raise ValueError("frame too long")
+            payload = await self.reader.readexactly(size)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        self.request_id = request_id
+        return payload
 
+    def reply(self, data):
+        """Ответ на текущую команду с учётом отправленных байтов"""
+        metrics.bytes_out += len(data)
+        if self.framed:
+            self.writer.write(FRAME.pack(REPLY, self.request_id, len(data)))
+            self.writer.write(data)
         else:
-            if not cow_name:
-                writer.write("Ошибка: Сначала зарегистрируйтесь с помощью 'login <название_коровы>'\n".encode())
+            self.writer.writelines((data, END_OF_BLOCK))
+
+    def push(self, batch):
+        """Асинхронные сообщения от других коров; в режиме framed каждое в своём кадре"""
+        if self.framed:
+            frames = []
+            for data in batch:
+                frames.append(FRAME.pack(PUSH, 0, len(data)))
+                frames.append(data)
+            batch = frames
+        self.writer.writelines(batch)
+
+
+# Таблица команд: глагол в байтах -> (имя для метрик, обработчик, принимает ли аргументы)
+COMMANDS = {}
+
+
+def command(name, takes_args=False):
+    def register(handler):
+        COMMANDS[name.encode()] = (name, handler, takes_args)
+        return handler
+    return register
+
+
+@command('login', takes_args=True)
+async def handle_login(session, args):
+    # Повторный login оставил бы за соединением очередь, комнаты и регистрацию старого имени
+    if session.cow_name:
+        session.reply(f"Ошибка: Вы уже зарегистрированы как '{session.cow_name}'\n".encode())
+        return
+
+    requested_name = args.decode()
+    if not requested_name:
+        session.reply(LOGIN_USAGE)
+        return
+
+    if requested_name not in catalog:
+        session.reply(f"Ошибка: Корова '{requested_name}' не существует\n".encode())
+        return
+
+    if not await claim_name(requested_name):
+        session.reply(f"Ошибка: Имя '{requested_name}' уже занято\n".encode())
+        return
+
+    cow_name = session.cow_name = requested_name
+    clients[cow_name] = Outbox(cow_name, session)
+    connections[cow_name] = (session.reader, session.writer)
+    senders[cow_name] = asyncio.create_task(message_sender(cow_name, clients[cow_name], session))
+
+    if config.default_room:
+        join_room(session, config.default_room)
+
+    session.reply(f"Вы успешно зарегистрировались как '{cow_name}'\n".encode())
+
+
+@command('help')
+async def handle_help(session, args):
+    session.reply(HELP)
+
+
+@command('who')
+async def handle_who(session, args):
+    names = registered_names()
+    if not names:
+        session.reply(NO_USERS)
+    else:
+        session.reply(("Зарегистрированные пользователи:\n" + "".join(f"- {name}\n" for name in names)).encode())
+
+
+@command('cows')
+async def handle_cows(session, args):
+    session.reply(catalog.free_cows_response())
+
+
+@command('say', takes_args=True)
+async def handle_say(session, args):
+    if not session.cow_name:
+        session.reply(LOGIN_FIRST)
+        return
+
+    if session.bucket is not None and not session.bucket.take():
+        metrics.limits['rate_limited'] += 1
+        session.reply(RATE_LIMITED)
+        return
+
+    parts = args.decode().split(maxsplit=1)
+    if len(parts) != 2:
+        session.reply(SAY_USAGE)
+        return
+
+    target_cow, msg_text = parts
+    offline = target_cow not in registered_names()
+    if offline and (mailbox is None or target_cow not in catalog):
+        session.reply(f"Ошибка: Пользователь '{target_cow}' не найден\n".encode())
+        return
+
+    message = Message(session.cow_name, 'say', msg_text)
+
+    # Рисуем, только если получатель не рисует сам; в почтовый ящик кладём рисунок,
+    # потому что неизвестно, каким клиентом корова вернётся
+    if offline or (target_cow in clients and not clients[target_cow].session.raw):
+        if await message.render() is None:
+            session.reply(OVERLOADED)
+            return
+
+    if offline:
+        mailbox.append(target_cow, message.art)
+        session.reply(f"Пользователь '{target_cow}' не в сети, сообщение будет доставлено при входе\n".encode())
+        return
+
+    if not deliver(target_cow, message):
+        session.reply(f"Ошибка: Очередь пользователя '{target_cow}' переполнена\n".encode())
+        return
+
+    session.reply(f"Сообщение отправлено пользователю '{target_cow}'\n".encode())
+
+
+@command('yield', takes_args=True)
+async def handle_yield(session, args):
+    if not session.cow_name:
+        session.reply(LOGIN_FIRST)
+        return
+
+    if not args:
+        session.reply(YIELD_USAGE)
+        return
+
+    if session.bucket is not None and not session.bucket.take():
+        metrics.limits['rate_limited'] += 1
+        session.reply(RATE_LIMITED)
+        return
+
+    if not session.rooms:
+        session.reply(NO_ROOMS)
+        return
+
+    message = Message(session.cow_name, 'yield', args.decode())
+    if not await publish(message, exclude=session.cow_name, room_names=sorted(session.rooms)):
+        session.reply(OVERLOADED)
+        return
+
+    if session.rooms == {config.default_room}:
+        session.reply(YIELD_SENT)
+    else:
+        session.reply(f"Сообщение отправлено в комнаты: {', '.join(sorted(session.rooms))}\n".encode())
+
+
+@command('join', takes_args=True)
+async def handle_join(session, args):
+    if not session.cow_name:
+        session.reply(LOGIN_FIRST)
+        return
+
+    room = args.decode()
+    if not room or len(room.split()) != 1:
+        session.reply(JOIN_USAGE)
+        return
+
+    join_room(session, room)
+    session.reply(f"Вы вошли в комнату '{room}'\n".encode())
+
+
+@command('leave', takes_args=True)
+async def handle_leave(session, args):
+    if not session.cow_name:
+        session.reply(LOGIN_FIRST)
+        return
+
+    room = args.decode()
+    if room not in session.rooms:
+        session.reply(LEAVE_USAGE if not room else f"Ошибка: Вы не состоите в комнате '{room}'\n".encode())
+        return
+
+    leave_room(session, room)
+    session.reply(f"Вы вышли из комнаты '{room}'\n".encode())
+
+
+@command('rooms')
+async def handle_rooms(session, args):
+    if not rooms:
+        session.reply("Нет комнат\n".encode())
+        return
+
+    # Членство в комнатах брокер не делит, поэтому с воркерами счёт только свой
+    if bus is None:
+        lines = ["Комнаты (* — вы участник):\n"]
+    else:
+        lines = ["Комнаты на этом воркере (* — вы участник, в скобках — участники этого воркера):\n"]
+    for room in sorted(rooms):
+        mark = "*" if room in session.rooms else " "
+        lines.append(f"- {room} {mark} ({len(rooms[room])})\n")
+    session.reply("".join(lines).encode())
+
+
+@command('admin', takes_args=True)
+async def handle_admin(session, args):
+    if not config.admin_token or args.decode() != config.admin_token:
+        session.reply(ADMIN_DENIED)
+        return
+
+    session.admin = True
+    session.reply(ADMIN_OK)
+
+
+@command('broadcast', takes_args=True)
+async def handle_broadcast(session, args):
+    if not session.admin:
+        session.reply(ADMIN_ONLY)
+        return
+
+    if not args:
+        session.reply(BROADCAST_USAGE)
+        return
+
+    message = Message(session.cow_name or 'default', 'broadcast', args.decode())
+    if not await publish(message, exclude=session.cow_name):
+        session.reply(OVERLOADED)
+        return
+
+    session.reply(BROADCAST_SENT)
+
+
+@command('proto', takes_args=True)
+async def handle_proto(session, args):
+    if args == b"raw":
+        session.raw = True
+        session.reply(RAW)
+        return
+
+    if args == b"presence":
+        session.presence = True
+        watchers[session] = None
+        session.reply(PRESENCE)
+        return
+
+    if args != b"framed":
+        session.reply(UNKNOWN_COMMAND if session.cow_name else LOGIN_FIRST)
+        return
+
+    if session.framed:
+        # Уже в кадрах: подтверждаем обычным ответом, а не строкой посреди потока кадров
+        session.reply(FRAMED)
+        return
+
+    # Подтверждение уходит ещё строкой и без пустой строки после: за ним сразу идут кадры.
+    # Режим переключается до drain(), чтобы рассылка, успевшая вклиниться, уже шла кадрами
+    metrics.bytes_out += len(FRAMED)
+    session.writer.write(FRAMED)
+    session.framed = True
+    await session.writer.drain()
+
+
+@command('quit')
+async def handle_quit(session, args):
+    session.reply(GOODBYE)
+    session.closing = True
+
+
+def valid_text(args):
+    """Аргументы декодируются обработчиками; проверяем заранее, чтобы они не падали на мусоре"""
+    try:
+        args.decode()
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+async def chat(reader, writer):
+    addr = "{}:{}".format(*writer.get_extra_info('peername'))
+
+    if config.max_connections and metrics.connections >= config.max_connections:
+        metrics.limits['rejected_connections'] += 1
+        writer.writelines((SERVER_FULL, END_OF_BLOCK))
+        writer.close()
+        return
+
+    print(f"Подключен новый клиент: {addr}")
+    metrics.connections += 1
+    metrics.connections_total += 1
+    session = Session(reader, writer)
+
+    try:
+        session.reply(WELCOME)
+        await writer.drain()
+
+        while not session.closing and not reader.at_eof():
+            try:
+                async with asyncio.timeout_at(session.deadline()):
+                    data = await session.read_command()
+            except TimeoutError:
+                if session.cow_name is None and config.login_timeout > 0 \
+                        and asyncio.get_running_loop().time() >= session.connected_at + config.login_timeout:
+                    metrics.limits['login_timeouts'] += 1
+                    session.reply(LOGIN_TIMEOUT)
+                else:
+                    metrics.limits['idle_reaped'] += 1
+                    session.reply(IDLE_TIMEOUT)
+                break
+            except ValueError:
+                metrics.limits['oversized_commands'] += 1
+                session.reply(LINE_TOO_LONG)
+                break
+
+            if data is None:
+                break
+
+            metrics.bytes_in += len(data)
+            started = time.perf_counter()
+
+            # Глагол берётся прямо из байтов; текст декодируют только обработчики с аргументами
+            parts = data.split(None, 1)
+            verb = parts[0] if parts else b""
+            args = parts[1].strip() if len(parts) > 1 else b""
+            name, handler, takes_args = COMMANDS.get(verb, ('unknown', None, False))
+
+            if handler is None or (args and not takes_args):
+                name = 'unknown'
+                session.reply(UNKNOWN_COMMAND if session.cow_name else LOGIN_FIRST)
+            elif not valid_text(args):
+                metrics.limits['bad_encoding'] += 1
+                session.reply(BAD_ENCODING)
             else:
-                writer.write("Ошибка: Неизвестная команда. Введите 'help' для списка команд\n".encode())
-            await writer.drain()
+                await handler(session, args)
+            try:
+                await writer.drain()
+            except ConnectionError:
+                break
+            metrics.command_done(name, started)
+    except ConnectionError:
+        pass
+    finally:
+        watchers.pop(session, None)
+        cow_name = session.cow_name
+        if cow_name and cow_name in clients:
+            clients.pop(cow_name).close()
+            del connections[cow_name]
+            senders.pop(cow_name).cancel()
+            for room in list(session.rooms):
+                leave_room(session, room)
+            release_name(cow_name)
+
+        print(f"Клиент отключился: {addr}")
+        metrics.connections -= 1
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+def encode_message(message):
+    """Закодировать сообщение для отправки один раз на всех получателей
+
+    Пустые строки внутри рисунка заменяются пробелом, а сам рисунок завершается
+    пустой строкой — так он остаётся одним блоком для построчных клиентов.
+    """
+    lines = (line or " " for line in message.split("\n"))
+    return ("\n".join(lines) + "\n").encode() + END_OF_BLOCK
+
+
+def registered_names():
+    """Имена всех зарегистрированных коров, в том числе на других воркерах"""
+    return clients if bus is None else bus.names
+
+
+async def claim_name(name):
+    """Занять имя коровы; False, если оно уже занято"""
+    if bus is not None:
+        return await bus.register(name)
+    if name in clients:
+        return False
+    name_joined(name)
+    return True
+
+
+def release_name(name):
+    if bus is not None:
+        bus.unregister(name)
+    else:
+        name_left(name)
+
+
+def name_joined(name):
+    """Корова вошла на этом или, через брокер, на другом воркере"""
+    catalog.take(name)
+    notify_presence(b"+", name)
+
+
+def name_left(name):
+    catalog.release(name)
+    notify_presence(b"-", name)
+
+
+def notify_presence(sign, name):
+    """Разослать подписчикам изменение состава, минуя очереди сообщений
+
+    Уведомление короче любой команды, поэтому пишется сразу. Подписчика, который
+    не читает, отписываем и сообщаем ему об этом, чтобы он вернулся к опросу who.
+    """
+    if not watchers:
+        return
+    data = PRESENCE_PREFIX + sign + name.encode() + b"\n"
+    for session in list(watchers):
+        if session.writer.transport.get_write_buffer_size() > config.queue_bytes:
+            session.presence = False
+            del watchers[session]
+            metrics.bytes_out += len(PRESENCE_OFF)
+            session.push([PRESENCE_OFF])
+            continue
+        metrics.bytes_out += len(data)
+        session.push([data])
+
+
+def deliver(target_cow, message):
+    """Передать сообщение корове, подключённой к этому или другому воркеру
+
+    Для локального получателя без raw сообщение уже должно быть нарисовано.
+    """
+    if target_cow in clients:
+        outbox = clients[target_cow]
+        return outbox.put(outbox.payload(message))
+    if bus is not None:
+        bus.say(target_cow, message.raw)
+        return True
+    return False
+
+
+async def receive_say(target_cow, raw):
+    """Сообщение для нашей коровы от другого воркера"""
+    outbox = clients.get(target_cow)
+    if outbox is None:
+        return
+    message = Message.from_raw(raw)
+    if outbox.session.raw or await message.render() is not None:
+        outbox.put(outbox.payload(message))
+
+
+def join_room(session, room):
+    session.rooms.add(room)
+    rooms.setdefault(room, {})[session.cow_name] = None
+
+
+def leave_room(session, room):
+    session.rooms.discard(room)
+    members = rooms.get(room)
+    if members is not None:
+        members.pop(session.cow_name, None)
+        if not members:
+            del rooms[room]
 
-    if cow_name and cow_name in clients:
-        del clients[cow_name]
-        del connections[cow_name]
 
-    print(f"Клиент отключился: {addr}")
-    writer.close()
-    await writer.wait_closed()
+async def broadcast(message, exclude=None, room_names=None):
+    """Разослать сообщение клиентам этого воркера, кроме exclude; False, если не удалось нарисовать
 
+    Без room_names — всем, иначе только участникам перечисленных комнат,
+    так что стоимость рассылки растёт с размером комнаты, а не всего сервера.
+    Рисунок строится один раз и только если среди получателей есть клиент без raw;
+    все получатели делят одни и те же буферы.
+    """
+    if room_names is None:
+        targets = clients
+    elif len(room_names) == 1:
+        targets = rooms.get(room_names[0], ())
+    else:
+        targets = set().union(*(rooms.get(room, ()) for room in room_names))
 
-async def message_handler():
+    outboxes = [clients[name] for name in targets if name != exclude]
+    if any(not outbox.session.raw for outbox in outboxes):
+        if await message.render() is None:
+            return False
+
+    for outbox in outboxes:
+        outbox.put(outbox.payload(message))
+    return True
+
+
+async def receive_yield(raw, exclude, room_names):
+    """Рассылка от другого воркера"""
+    await broadcast(Message.from_raw(raw), exclude, room_names)
+
+
+async def publish(message, exclude=None, room_names=None):
+    """Разослать сообщение клиентам всех воркеров"""
+    if not await broadcast(message, exclude, room_names):
+        return False
+    if bus is not None:
+        bus.broadcast(message.raw, exclude, room_names)
+    return True
+
+
+async def message_sender(cow_name, outbox, session):
+    """Доставка сообщений одному клиенту по мере появления их в очереди"""
     while True:
-        for cow_name, (reader, writer) in list(connections.items()):
-            try:
-                if not clients[cow_name].empty():
-                    message = await clients[cow_name].get()
-                    writer.write(f"{message}\n".encode())
-                    await writer.drain()
-            except Exception as e:
-                print(f"Ошибка при отправке сообщения для {cow_name}: {e}")
+        batch = await outbox.get_batch()
+        try:
+            # Все накопившиеся сообщения уходят одной векторной записью без склейки буферов
+            session.push(batch)
+            await session.writer.drain()
+        except Exception as e:
+            print(f"Ошибка при отправке сообщения для {cow_name}: {e}")
+            break
+        sent = sum(map(len, batch))
+        outbox.sent_bytes += sent
+        metrics.bytes_out += sent
 
-        await asyncio.sleep(0.1)
+
+async def sweep_mailbox():
+    """Ящики коров, которые не возвращаются, сами не чистятся: проходим по ним по таймеру"""
+    while True:
+        await asyncio.sleep(config.mailbox_sweep)
+        mailbox.sweep()
 
 
-async def main():
-    server = await asyncio.start_server(chat, '0.0.0.0', 1337)
+async def serve():
+    global bus, mailbox
+
+    if config.mailbox_dir:
+        mailbox = cow_chat_mailbox.Mailbox(config.mailbox_dir, config.mailbox_segment,
+                                           config.mailbox_max_bytes, config.mailbox_max_age)
+        mailbox.sweep()
+
+    if config.render_workers > 0:
+        if config.render_executor == 'process':
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=config.render_workers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.render_workers)
+        render_cache.pool = RenderPool(executor)
 
-    message_task = asyncio.create_task(message_handler())
+    if config.bus_path:
+        bus = cow_chat_bus.BusClient(
+            on_say=receive_say,
+            on_yield=receive_yield,
+            on_joined=name_joined,
+            on_left=name_left,
+            on_lost=lambda: server.close(),
+        )
+        await bus.connect(config.bus_path)
+
+    metrics.queues = lambda: {name: (len(outbox.messages), outbox.peak, outbox.queued_bytes)
+                              for name, outbox in clients.items()}
+    metrics.gauges = lambda: {
+        "render_cache_hits": render_cache.hits,
+        "render_cache_misses": render_cache.misses,
+        "render_queue": render_cache.pool.queued if render_cache.pool is not None else 0,
+        "dropped_messages": sum(outbox.dropped for outbox in clients.values()),
+        "mailbox_appended_bytes": mailbox.appended_bytes if mailbox is not None else 0,
+        "mailbox_replayed_bytes": mailbox.replayed_bytes if mailbox is not None else 0,
+        "mailbox_expired_bytes": mailbox.expired_bytes if mailbox is not None else 0,
+    }
+    lag_task = asyncio.create_task(metrics.watch_loop_lag())
+    sweep_task = asyncio.create_task(sweep_mailbox()) if mailbox is not None else None
+    if config.stats_port:
+        await asyncio.start_server(metrics.serve_stats, '127.0.0.1', config.stats_port)
+
+    server = await asyncio.start_server(chat, config.host, config.port, limit=config.max_line,
+                                        backlog=config.backlog, reuse_port=bus is not None)
 
     addr = server.sockets[0].getsockname()
-    print(f"Сервер запущен на {addr}")
+    print(f"Сервер запущен на {addr} (pid {os.getpid()})")
+
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        lag_task.cancel()
+        if sweep_task is not None:
+            sweep_task.cancel()
+        if render_cache.pool is not None:
+            render_cache.pool.shutdown()
+        if bus is not None:
+            bus.close()
+
+
+def run_worker(options, index):
+    """Точка входа процесса-воркера"""
+    global config
+    config = options
+    if config.stats_port:
+        # У каждого воркера своя статистика на соседнем порту
+        config.stats_port += index
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
 
-    async with server:
-        await server.serve_forever()
+
+def main():
+    if config.workers <= 1:
+        asyncio.run(serve())
+        return
+
+    # Несколько процессов принимают соединения на одном порту,
+    # а реестр имён и пересылка сообщений идут через процесс-брокер
+    if not config.bus_path:
+        config.bus_path = os.path.join(tempfile.gettempdir(), f"cow_chat_{config.port}.sock")
+
+    broker = multiprocessing.Process(target=cow_chat_bus.run_broker, args=(config.bus_path,))
+    broker.start()
+
+    workers = [multiprocessing.Process(target=run_worker, args=(config, index)) for index in range(config.workers)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for process in workers + [broker]:
+            if process.is_alive():
+                process.terminate()
+            process.join()
 
 
 if __name__ == "__main__":
+    config = parser.parse_args()
+    if config.queue_policy == 'spill' and not config.mailbox_dir:
+        parser.error("политике spill нужен --mailbox-dir")
     try:
-        asyncio.run(main())
+        main()
     except KeyboardInterrupt:
         print("Сервер остановлен")
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import cow_chat_mailbox
+
+
+def message(number):
+    return f"сообщение {number}".encode()
+
+
+class MailboxTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.mailbox = self.open_mailbox()
+
+    def open_mailbox(self, segment_bytes=100, max_bytes=1 << 20, max_age=3600):
+        mailbox = cow_chat_mailbox.Mailbox(self.directory.name, segment_bytes, max_bytes, max_age)
+        self.addCleanup(mailbox.close, "tux")
+        return mailbox
+
+    def test_order_across_segments(self):
+        for number in range(20):
+            self.mailbox.append("tux", message(number))
+        self.assertGreater(len(self.mailbox.segments("tux")), 1)
+
+        self.assertEqual(self.mailbox.read("tux", 1 << 20), [message(number) for number in range(20)])
+        self.assertFalse(self.mailbox.has_pending("tux"))
+        self.assertEqual(self.mailbox.read("tux", 1 << 20), [])
+
+    def test_cursor_resumes_inside_segment(self):
+        mailbox = self.open_mailbox(segment_bytes=1 << 20)
+        for number in range(10):
+            mailbox.append("tux", message(number))
+
+        first = mailbox.read("tux", 3 * len(message(0)))
+        self.assertEqual(first, [message(number) for number in range(3)])
+
+        # Дописанное после частичного чтения приходит следом, без повторов
+        mailbox.append("tux", message(10))
+        self.assertEqual(mailbox.read("tux", 1 << 20), [message(number) for number in range(3, 11)])
+
+    def test_prepend_goes_before_stored(self):
+        # В пустой ящик — обычной дозаписью
+        self.mailbox.prepend("tux", [message(2)])
+        for number in range(3, 6):
+            self.mailbox.append("tux", message(number))
+        self.mailbox.prepend("tux", [message(0), message(1)])
+        self.assertEqual(self.mailbox.read("tux", 1 << 20), [message(number) for number in range(6)])
+
+    def test_size_limit_drops_oldest_segments(self):
+        mailbox = self.open_mailbox(segment_bytes=100, max_bytes=300)
+        for number in range(100):
+            mailbox.append("tux", message(number))
+
+        replayed = mailbox.read("tux", 1 << 20)
+        self.assertGreater(mailbox.expired_bytes, 0)
+        self.assertLess(len(replayed), 100)
+        self.assertEqual(replayed, [message(number) for number in range(100 - len(replayed), 100)])
+
+    def test_expired_records_are_skipped(self):
+        mailbox = self.open_mailbox(max_age=60)
+        with mock.patch.object(cow_chat_mailbox.time, "time", return_value=time.time() - 120):
+            mailbox.append("tux", message(0))
+        mailbox.append("tux", message(1))
+
+        self.assertEqual(mailbox.read("tux", 1 << 20), [message(1)])
+        self.assertEqual(mailbox.expired_bytes, len(message(0)))
+
+    def test_sweep_removes_abandoned_mailbox(self):
+        mailbox = self.open_mailbox(max_age=60)
+        mailbox.append("tux", message(0))
+        mailbox.close("tux")
+        old = time.time() - 120
+        for number in mailbox.segments("tux"):
+            os.utime(mailbox.path("tux", number), (old, old))
+
+        mailbox.sweep()
+        self.assertFalse(mailbox.has_pending("tux"))
+        self.assertFalse(os.path.exists(mailbox.directory("tux")))
+
+
+if __name__ == "__main__":
+    unittest.main()
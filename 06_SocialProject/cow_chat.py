@@ -0,0 +1,645 @@
+import asyncio
+import bisect
+import collections
+import functools
+import json
+import random
+import struct
+import time
+
+import cowsay
+
+# Кадр протокола framed: тип, номер запроса, длина полезной нагрузки
+FRAME = struct.Struct("!BII")
+REQUEST, REPLY, PUSH = 1, 2, 3
+
+# Сообщение без рисунка (возможность raw): префикс и JSON с коровой и текстом
+RAW_PREFIX = "@msg "
+# Изменение состава чата (возможность presence): "+имя" или "-имя"
+PRESENCE_PREFIX = "@presence "
+# Ответы, после которых сервер сам закрывает соединение: переподключаться после них незачем
+FAREWELLS = (
+    "До свидания!",
+    "Ошибка: Время на регистрацию истекло",
+    "Соединение закрыто из-за неактивности",
+)
+SERVER_FULL = "Ошибка: Сервер переполнен"
+CAPTIONS = {
+    'say': "От {cow}: {text}",
+    'yield': "От {cow} всем: {text}",
+    'broadcast': "Всем от администратора: {text}",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def cow_template(cow):
+    """Шаблон коровы читается с диска один раз; тестовые имена вида tux-17 рисуются как tux"""
+    for name in (cow, cow.rpartition('-')[0], 'default'):
+        try:
+            return cowsay.get_cow(name)
+        except (FileNotFoundError, ValueError):
+            continue
+
+
+class ChatMessage:
+    """Входящее сообщение: поля raw-сообщения или уже готовый рисунок от сервера"""
+
+    def __init__(self, cow=None, kind=None, text=None, mode='say', art=None):
+        self.cow = cow
+        self.kind = kind
+        self.text = text
+        self.mode = mode
+        self._art = art
+
+    @classmethod
+    def from_raw(cls, line):
+        fields = json.loads(line[len(RAW_PREFIX):])
+        return cls(fields["cow"], fields["kind"], fields["text"], fields.get("mode", 'say'))
+
+    @property
+    def art(self):
+        """Рисунок сообщения; raw-сообщение рисуется при первом обращении"""
+        if self._art is None:
+            caption = CAPTIONS.get(self.kind, "{text}").format(cow=self.cow, text=self.text)
+            draw = cowsay.cowthink if self.mode == "think" else cowsay.cowsay
+            self._art = draw(caption, cowfile=cow_template(self.cow))
+        return self._art
+
+    def __str__(self):
+        return self.art
+
+
+class NameIndex:
+    """Отсортированные имена для поиска по префиксу
+
+    Изменения не трогают текущий список, а подменяют его копией, поэтому
+    поток readline читает индекс без блокировок, пока цикл событий его обновляет.
+    """
+
+    def __init__(self, names=()):
+        self.names = sorted(set(names))
+
+    def __contains__(self, name):
+        index = bisect.bisect_left(self.names, name)
+        return index < len(self.names) and self.names[index] == name
+
+    def add(self, name):
+        index = bisect.bisect_left(self.names, name)
+        if index == len(self.names) or self.names[index] != name:
+            self.names = self.names[:index] + [name] + self.names[index:]
+
+    def discard(self, name):
+        index = bisect.bisect_left(self.names, name)
+        if index < len(self.names) and self.names[index] == name:
+            self.names = self.names[:index] + self.names[index + 1:]
+
+    def prefix(self, text):
+        names = self.names
+        start = bisect.bisect_left(names, text)
+        end = bisect.bisect_left(names, text + chr(0x10ffff), start)
+        return names[start:end]
+
+
+class PresenceCache:
+    """Кто в чате и какие коровы свободны — для автодополнения без запросов к серверу
+
+    Если сервер присылает уведомления presence, кэш обновляется ими и не устаревает;
+    иначе он считается устаревшим через ttl секунд и перечитывается в фоне. Сервер
+    может отписать медленного клиента уведомлением "off" — тогда кэш снова живёт по ttl.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.users = NameIndex()
+        self.cows = NameIndex()
+        self.all_cows = frozenset(cowsay.list_cows())
+        self.fetched_at = None
+        self.live = False
+        self.refreshing = False
+        # Уведомления, пришедшие во время перечитывания: их применяем поверх снимка
+        self.log = None
+
+    def stale(self):
+        if self.fetched_at is None:
+            return True
+        return not self.live and time.monotonic() - self.fetched_at > self.ttl
+
+    def begin_refresh(self):
+        self.refreshing = True
+        self.log = []
+
+    def reset(self, users, cows):
+        """Подменить содержимое снимком who/cows и доиграть уведомления, пришедшие за это время"""
+        self.all_cows |= frozenset(cows)
+        self.users = NameIndex(users)
+        self.cows = NameIndex(cows)
+        log, self.log = self.log or [], None
+        for sign, name in log:
+            self.apply(sign, name)
+        self.fetched_at = time.monotonic()
+        self.refreshing = False
+
+    def cancel_refresh(self):
+        self.refreshing = False
+        self.log = None
+
+    def update(self, line):
+        """Уведомление вида "+имя", "-имя" или "off" от сервера"""
+        if line == "off":
+            self.live = False
+            return
+        sign, name = line[:1], line[1:]
+        if self.log is not None:
+            self.log.append((sign, name))
+        self.apply(sign, name)
+
+    def apply(self, sign, name):
+        if sign == "+":
+            self.users.add(name)
+            self.cows.discard(name)
+        else:
+            self.users.discard(name)
+            if name in self.all_cows:
+                self.cows.add(name)
+
+
+class LineParser:
+    """Потоковый разбор построчного протокола на ответы и сообщения
+
+    Сервер завершает каждый ответ и каждый рисунок пустой строкой, а служебные
+    сообщения (@msg, @presence) приходят по одному в строке, поэтому поток
+    режется на блоки без эвристик и таймаутов.
+    Рисунок отличается от ответа тем, что начинается с пробела — верхней границы облачка.
+    Старый сервер блоки не завершает; с ним (blocks=False) блоком считается каждая строка.
+    """
+
+    def __init__(self, blocks=True):
+        self.blocks = blocks
+        self.buffer = b""
+        self.lines = []
+        # Готовые события: (REPLY или PUSH, текст)
+        self.events = collections.deque()
+
+    def feed(self, data):
+        """Добавить прочитанные байты; неполная последняя строка ждёт следующей порции"""
+        *complete, self.buffer = (self.buffer + data).split(b"\n")
+        for raw_line in complete:
+            line = raw_line.decode().rstrip('\r')
+
+            if not self.lines and line.startswith('@'):
+                self.events.append((PUSH, line))
+            elif line:
+                self.lines.append(line)
+                if not self.blocks:
+                    self.finish_block()
+            elif self.lines:
+                self.finish_block()
+
+    def finish_block(self):
+        block = "\n".join(self.lines)
+        self.lines = []
+        self.events.append((PUSH if block[0].isspace() else REPLY, block))
+
+
+class CowChat:
+    """Асинхронный клиент коровьего чата без интерфейса: для ботов, рассылок и оболочки
+
+        async with CowChat(host, port) as chat:
+            await chat.login("tux")
+            await chat.say_many(("koala", f"привет {i}") for i in range(1000))
+            async for message in chat.messages():
+                print(message)
+
+    Команды можно отправлять, не дожидаясь ответов: send() возвращает future,
+    а ответы сопоставляются с командами по номеру кадра или по порядку строк.
+
+    При обрыве соединения клиент переподключается с экспоненциальной задержкой
+    со случайным разбросом, снова входит под той же коровой и возвращается в свои
+    комнаты. Задержка сбрасывается, только если соединение продержалось stable_after
+    секунд; после прощания сервера (quit, таймауты) клиент не переподключается. Команды, отданные во время обрыва, копятся в ограниченной очереди и
+    уходят после восстановления; команды, ушедшие до обрыва, получают ответ None —
+    неизвестно, успел ли сервер их выполнить.
+    """
+
+    def __init__(self, host='localhost', port=1337, framed=True, presence_ttl=30.0, inbox_size=1024,
+                 reconnect=True, backoff_base=0.5, backoff_max=30.0, backlog_size=256,
+                 stable_after=60.0, on_lost=None, on_restored=None):
+        self.host = host
+        self.port = port
+        self.use_framed = framed
+        self.reader = None
+        self.writer = None
+        self.running = False
+        self.closed = False
+        self.cow_name = None
+        self.rooms = set()
+        self.welcome = ""
+
+        # Готовность: установлено, пока есть соединение и можно слать команды
+        self.connected = asyncio.Event()
+
+        # Переподключение: задержка растёт от backoff_base до backoff_max
+        self.reconnect = reconnect
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        # Последний ответ сервера перед закрытием соединения с его стороны
+        self.farewell = None
+        self.backlog = collections.deque()
+        self.backlog_size = backlog_size
+        self.on_lost = on_lost
+        self.on_restored = on_restored
+
+        # Кэш для списков коров и пользователей
+        self.presence = PresenceCache(presence_ttl)
+
+        # Входящие сообщения; если их никто не читает, старые вытесняются новыми
+        self.inbox = asyncio.Queue(inbox_size)
+        self.dropped = 0
+
+        # Построчный протокол: ответы приходят в порядке команд, поэтому
+        # ожидающие команды стоят в очереди (None — ответ не нужен)
+        self.parser = None
+        self.waiting = collections.deque()
+
+        # Кадровый протокол: ответы сопоставляются с запросами по номеру
+        self.framed = False
+        self.last_request_id = 0
+        self.pending = {}
+
+        # Сервер присылает текст и имя коровы, а рисуем мы сами
+        self.raw = False
+
+        self.supervisor = None
+        self.refresher = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):
+        """Установить соединение с сервером и запустить приёмник"""
+        await self.open()
+        self.running = True
+        self.connected.set()
+        self.supervisor = asyncio.create_task(self.supervise())
+        self.start_refresh()
+
+    async def open(self):
+        """Открыть соединение и договориться о возможностях; команды ещё не принимаются"""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.farewell = None
+        self.framed = False
+        self.parser = None
+
+        if self.use_framed:
+            self.framed = await self.negotiate()
+            if not self.framed:
+                self.parser = LineParser(blocks=False)
+        else:
+            self.parser = LineParser()
+            self.welcome = await self.read_reply()
+            if self.welcome is None:
+                raise ConnectionError("Сервер закрыл соединение")
+            if self.welcome.startswith(SERVER_FULL):
+                raise ConnectionRefusedError(self.welcome)
+
+        if self.framed or self.parser.blocks:
+            self.raw = (await self.early_command("proto raw") or "").startswith("Протокол: raw")
+            self.presence.live = (await self.early_command("proto presence") or "").startswith(
+                "Протокол: presence")
+
+    def start_refresh(self):
+        self.presence.refreshing = True
+        self.refresher = asyncio.create_task(self.refresh_presence())
+
+    async def close(self):
+        self.running = False
+        self.closed = True
+        if self.supervisor is not None:
+            self.supervisor.cancel()
+            await asyncio.gather(self.supervisor, return_exceptions=True)
+        await self.close_writer()
+
+    async def close_writer(self):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def supervise(self):
+        """Принимать сообщения, а после обрыва переподключаться, пока клиент не закрыт"""
+        attempt = 0
+        try:
+            while True:
+                opened_at = time.monotonic()
+                await self.receive()
+                if self.closed or not self.reconnect or self.farewell is not None:
+                    break
+                # Окно задержки растёт, пока соединения рвутся вскоре после установки
+                if time.monotonic() - opened_at >= self.stable_after:
+                    attempt = 0
+                if self.on_lost is not None:
+                    self.on_lost()
+                attempt = await self.restore(attempt)
+                if self.on_restored is not None:
+                    self.on_restored()
+        finally:
+            self.running = False
+            self.connected.clear()
+            for _, future in self.backlog:
+                if future is not None and not future.done():
+                    future.set_result(None)
+            self.backlog.clear()
+
+            # None в очереди входящих означает конец потока
+            if self.inbox.full():
+                self.inbox.get_nowait()
+            self.inbox.put_nowait(None)
+
+    def backoff(self, attempt):
+        """Задержка перед попыткой: случайная в пределах растущего окна, чтобы клиенты не шли толпой"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def restore(self, attempt=0):
+        """Переподключиться, вернуть корову и комнаты, дослать накопленные команды
+
+        Возвращает номер следующей попытки, чтобы частые обрывы не сбрасывали задержку.
+        """
+        while True:
+            await asyncio.sleep(self.backoff(attempt))
+            attempt += 1
+            try:
+                await self.open()
+                # Старое соединение сервер мог ещё не закрыть — тогда имя пока занято
+                if self.cow_name is not None:
+                    reply = await self.early_command(f"login {self.cow_name}")
+                    if not reply or 'успешно зарегистрировались' not in reply:
+                        raise ConnectionError(reply)
+                for room in sorted(self.rooms):
+                    await self.early_command(f"join {room}")
+                break
+            except (OSError, asyncio.IncompleteReadError):
+                await self.close_writer()
+
+        # Накопленные команды уходят раньше новых
+        while self.backlog:
+            command, future = self.backlog.popleft()
+            self.write_command(command, future)
+        self.running = True
+        self.connected.set()
+        self.start_refresh()
+        return attempt
+
+    async def negotiate(self):
+        """Перейти на кадровый протокол, если сервер его поддерживает"""
+        self.writer.write(b"proto framed\n")
+        await self.writer.drain()
+
+        welcome = []
+        while True:
+            data = await self.reader.readline()
+            if not data:
+                raise ConnectionError("Сервер закрыл соединение")
+
+            line = data.decode().strip()
+            if line.startswith(SERVER_FULL):
+                raise ConnectionRefusedError(line)
+            if line.startswith("Протокол: framed"):
+                self.welcome = "\n".join(welcome)
+                return True
+            if line.startswith("Ошибка"):
+                # Старый сервер не знает команды proto — остаёмся на строках
+                self.welcome = "\n".join(welcome)
+                return False
+            if line:
+                welcome.append(line)
+
+    async def early_command(self, command):
+        """Выполнить команду до запуска приёмника, например договориться о возможностях"""
+        if not self.framed:
+            self.writer.write(f"{command}\n".encode())
+            await self.writer.drain()
+            return await self.read_reply()
+
+        self.last_request_id += 1
+        payload = command.encode()
+        self.writer.write(FRAME.pack(REQUEST, self.last_request_id, len(payload)) + payload)
+        await self.writer.drain()
+
+        while True:
+            kind, request_id, size = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+            message = (await self.reader.readexactly(size)).decode()
+            if kind == REPLY:
+                return message
+            self.handle_push(message.rstrip('\n'))
+
+    async def read_reply(self):
+        """Дочитать следующий ответ построчного протокола; вызывается до запуска приёмника"""
+        while True:
+            while self.parser.events:
+                kind, text = self.parser.events.popleft()
+                if kind == REPLY:
+                    return text
+                self.handle_push(text)
+
+            data = await self.reader.read(1 << 16)
+            if not data:
+                return None
+            self.parser.feed(data)
+
+    def handle_push(self, message):
+        """Сообщение, пришедшее не в ответ на команду: уведомление в кэш, остальное во входящие"""
+        if message.startswith(PRESENCE_PREFIX):
+            self.presence.update(message[len(PRESENCE_PREFIX):])
+            return
+
+        if message.startswith(RAW_PREFIX):
+            message = ChatMessage.from_raw(message)
+        else:
+            message = ChatMessage(art=message)
+
+        if self.inbox.full():
+            self.inbox.get_nowait()
+            self.dropped += 1
+        self.inbox.put_nowait(message)
+
+    async def receive_frame(self):
+        """Прочитать один кадр: ответ отдаётся ожидающей команде, остальное — в handle_push"""
+        kind, request_id, size = FRAME.unpack(await self.reader.readexactly(FRAME.size))
+        message = (await self.reader.readexactly(size)).decode().rstrip('\n')
+
+        if kind == REPLY:
+            self.check_farewell(message)
+            future = self.pending.pop(request_id, None)
+            if future is not None and not future.done():
+                future.set_result(message)
+        else:
+            self.handle_push(message)
+
+    async def receive_lines(self):
+        """Прочитать порцию построчного потока: ответы отдаются командам по порядку"""
+        data = await self.reader.read(1 << 16)
+        if not data:
+            return False
+
+        self.parser.feed(data)
+        while self.parser.events:
+            kind, text = self.parser.events.popleft()
+            if kind == REPLY:
+                self.check_farewell(text)
+            if kind == REPLY and self.waiting:
+                future = self.waiting.popleft()
+                if future is not None and not future.done():
+                    future.set_result(text)
+            else:
+                self.handle_push(text)
+        return True
+
+    def check_farewell(self, text):
+        if text.startswith(FAREWELLS):
+            self.farewell = text
+
+    async def receive(self):
+        """Приёмник входящего потока; возвращается, когда соединение закрыто"""
+        try:
+            while self.running:
+                if self.framed:
+                    await self.receive_frame()
+                elif not await self.receive_lines():
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.running = False
+            self.connected.clear()
+            for future in [*self.pending.values(), *self.waiting]:
+                if future is not None and not future.done():
+                    future.set_result(None)
+            self.pending.clear()
+            self.waiting.clear()
+
+    async def messages(self):
+        """Входящие сообщения по мере поступления, пока соединение открыто"""
+        while True:
+            message = await self.inbox.get()
+            if message is None:
+                return
+            yield message
+
+    def send(self, command, wait_response=True):
+        """Отправить команду, не дожидаясь ответа и не сбрасывая буфер
+
+        Возвращает future с текстом ответа (None, если соединение потеряно)
+        или None, если ответ не нужен. Во время переподключения команда
+        встаёт в очередь; если очередь полна, выбрасывается ConnectionError.
+        """
+        if not self.running:
+            if self.closed or not self.reconnect or self.supervisor is None:
+                raise ConnectionError("Не подключен к серверу")
+            if len(self.backlog) >= self.backlog_size:
+                raise ConnectionError("Нет связи с сервером, очередь команд переполнена")
+
+        future = asyncio.get_running_loop().create_future() if wait_response else None
+        if self.running:
+            self.write_command(command, future)
+        else:
+            self.backlog.append((command, future))
+        return future
+
+    def write_command(self, command, future):
+        if self.framed:
+            self.last_request_id += 1
+            if future is not None:
+                self.pending[self.last_request_id] = future
+            payload = command.encode()
+            self.writer.write(FRAME.pack(REQUEST, self.last_request_id, len(payload)) + payload)
+        else:
+            # Очередь ожидания пополняется в том же порядке, в каком команды уходят на сервер
+            self.waiting.append(future)
+            self.writer.write(f"{command}\n".encode())
+
+    async def drain(self):
+        """Дождаться, пока буфер отправки опустеет; при обрыве ответы придут как None"""
+        if self.running:
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+
+    async def command(self, command, wait_response=True):
+        """Отправить команду и дождаться ответа"""
+        future = self.send(command, wait_response)
+        await self.drain()
+        return await future if future is not None else None
+
+    async def command_many(self, commands):
+        """Отправить команды одной пачкой и дождаться всех ответов, сохраняя их порядок"""
+        futures = [self.send(command) for command in commands]
+        await self.drain()
+        return await asyncio.gather(*futures)
+
+    async def login(self, cow_name):
+        response = await self.command(f"login {cow_name}")
+        if response and 'успешно зарегистрировались' in response:
+            self.cow_name = cow_name
+            self.rooms.clear()
+        return response
+
+    async def say(self, target, text):
+        return await self.command(f"say {target} {text}")
+
+    async def say_many(self, messages):
+        """Послать пачку личных сообщений: пары (получатель, текст)"""
+        return await self.command_many(f"say {target} {text}" for target, text in messages)
+
+    async def yield_(self, text):
+        return await self.command(f"yield {text}")
+
+    async def join(self, room):
+        response = await self.command(f"join {room}")
+        if response and response.startswith("Вы вошли"):
+            self.rooms.add(room)
+        return response
+
+    async def leave(self, room):
+        response = await self.command(f"leave {room}")
+        if response and response.startswith("Вы вышли"):
+            self.rooms.discard(room)
+        return response
+
+    async def quit(self):
+        if self.running:
+            await self.command("quit", False)
+        await self.close()
+
+    async def cows(self):
+        """Свободные имена коров; None, если соединение потеряно"""
+        response = await self.command("cows")
+        if response is None:
+            return None
+        return [line[2:] for line in response.split('\n') if line.startswith('- ')]
+
+    async def who(self):
+        """Зарегистрированные пользователи; None, если соединение потеряно"""
+        response = await self.command("who")
+        if response is None:
+            return None
+        return [line[2:] for line in response.split('\n') if line.startswith('- ')]
+
+    async def refresh_presence(self):
+        """Перечитать кэш присутствия двумя запросами, отправленными разом"""
+        self.presence.begin_refresh()
+        try:
+            users, cows = await asyncio.gather(self.who(), self.cows())
+        except ConnectionError:
+            users = cows = None
+        if users is None or cows is None:
+            self.presence.cancel_refresh()
+        else:
+            self.presence.reset(users, cows)
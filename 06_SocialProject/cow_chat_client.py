@@ -3,124 +3,67 @@ import cmd
 import sys
 import threading
 
+from cow_chat import CowChat
+
 
 class CowClient(cmd.Cmd):
+    """Консольная оболочка над CowChat: команды cmd выполняются в цикле событий фонового потока"""
+
     prompt = '> '
     intro = 'Добро пожаловать в клиент коровьего чата! Используйте help для получения списка команд.\n'
 
-    def __init__(self, host='localhost', port=1337):
+    def __init__(self, host='localhost', port=1337, framed=True, presence_ttl=30.0):
         super().__init__()
-        self.host = host
-        self.port = port
-        self.reader = None
-        self.writer = None
-        self.logged_in = False
-        self.running = False
-        self.cow_name = None
-
-        # Кэш для списков коров и пользователей
-        self.available_cows = []
-        self.registered_users = []
-
-        # Блокировки для предотвращения конфликтов чтения/записи
-        self.command_lock = None
-
-        # Очередь для входящих сообщений
-        self.message_queue = None
+        self.chat = CowChat(host, port, framed, presence_ttl,
+                            on_lost=self.connection_lost, on_restored=self.connection_restored)
 
         # Эвент-луп для асинхронных операций
         self.loop = None
 
+    @property
+    def running(self):
+        return self.chat.running
+
+    @property
+    def logged_in(self):
+        return self.chat.cow_name is not None
+
     async def connect(self):
         """Установить соединение с сервером"""
         try:
-            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
-            self.running = True
-
-            # Инициализируем блокировку и очередь
-            self.command_lock = asyncio.Lock()
-            self.message_queue = asyncio.Queue()
-
-            welcome = await self.reader.readline()
-            print(welcome.decode().strip())
-
-            return True
+            await self.chat.connect()
         except Exception as e:
             print(f"Ошибка подключения: {e}")
             return False
 
-    async def message_receiver(self):
-        """Асинхронный обработчик входящих сообщений"""
-        while self.running:
-            try:
-                data = await self.reader.readline()
-                if not data:
-                    print("\nСоединение с сервером потеряно")
-                    self.running = False
-                    break
-
-                message = data.decode().strip()
-                if message:
-                    if message.startswith(' ') or '(' in message[:10]:
-                        print(f"\n{message}")
-                        print(self.prompt, end='', flush=True)
-                    else:
-                        # Добавляем сообщение в очередь для обработки командами
-                        await self.message_queue.put(message)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                print(f"\nОшибка при получении сообщения: {e}")
-                break
-
-    async def execute_command(self, command, wait_response=True):
-        """Отправить команду на сервер и опционально получить ответ"""
-        if not self.running or not self.writer:
-            print("Не подключен к серверу")
-            return None
-
-        async with self.command_lock:
-            try:
-                self.writer.write(f"{command}\n".encode())
-                await self.writer.drain()
-
-                if wait_response:
-                    try:
-                        response = await asyncio.wait_for(self.message_queue.get(), 2.0)
-                        return response
-                    except asyncio.TimeoutError:
-                        print("Превышено время ожидания ответа от сервера")
-                        return None
-                return None
-            except Exception as e:
-                print(f"Ошибка при выполнении команды: {e}")
-                return None
-
-    async def get_cows_list(self):
-        """Получить список доступных коров с сервера"""
-        response = await self.execute_command("cows")
-        self.available_cows = []
-
-        if response:
-            lines = response.split('\n')
-            for line in lines:
-                if line.startswith('- '):
-                    self.available_cows.append(line[2:])
-
-        return self.available_cows
-
-    async def get_users_list(self):
-        """Получить список зарегистрированных пользователей с сервера"""
-        response = await self.execute_command("who")
-        self.registered_users = []
-
-        if response:
-            lines = response.split('\n')
-            for line in lines:
-                if line.startswith('- '):
-                    self.registered_users.append(line[2:])
+        if self.chat.welcome:
+            print(self.chat.welcome)
+        return True
 
-        return self.registered_users
+    def connection_lost(self):
+        print("\nСоединение с сервером потеряно, переподключаемся...")
+
+    def connection_restored(self):
+        print("\nСоединение восстановлено")
+        print(self.prompt, end='', flush=True)
+
+    async def message_printer(self):
+        """Печатать входящие сообщения, пока соединение открыто"""
+        async for message in self.chat.messages():
+            print(f"\n{message}")
+            print(self.prompt, end='', flush=True)
+        if self.chat.farewell is not None:
+            print(f"\nСервер закрыл соединение: {self.chat.farewell}")
+        elif not self.chat.closed:
+            print("\nСоединение с сервером потеряно")
+
+    def completions(self, names, text):
+        """Дополнение из кэша без ожидания сети; устаревший кэш перечитывается в фоне"""
+        presence = self.chat.presence
+        if presence.stale() and not presence.refreshing and self.running:
+            presence.refreshing = True
+            asyncio.run_coroutine_threadsafe(self.chat.refresh_presence(), self.loop)
+        return names.prefix(text)
 
     def run_async(self, coro):
         """Запустить корутину из синхронного кода"""
@@ -142,25 +85,13 @@ class CowClient(cmd.Cmd):
             print("Используйте: login <название_коровы>")
             return
 
-        response = self.run_async(self.execute_command(f"login {arg}"))
-        if response and 'успешно зарегистрировались' in response:
-            self.logged_in = True
-            self.cow_name = arg
-
+        response = self.run_async(self.chat.login(arg))
         if response:
             print(response)
 
     def complete_login(self, text, line, begidx, endidx):
         """Автодополнение для команды login"""
-        cows = self.run_async(self.get_cows_list())
-
-        if not cows:
-            return []
-
-        if not text:
-            return cows
-        else:
-            return [cow for cow in cows if cow.startswith(text)]
+        return self.completions(self.chat.presence.cows, text)
 
     def do_say(self, arg):
         """Послать сообщение пользователю: say <название_коровы> <текст сообщения>"""
@@ -173,7 +104,7 @@ class CowClient(cmd.Cmd):
             print("Используйте: say <название_коровы> <текст сообщения>")
             return
 
-        response = self.run_async(self.execute_command(f"say {arg}"))
+        response = self.run_async(self.chat.command(f"say {arg}"))
         if response:
             print(response)
 
@@ -183,15 +114,7 @@ class CowClient(cmd.Cmd):
 
         # Если вводится имя пользователя (части: "say" и возможно часть имени)
         if len(parts) <= 2:
-            users = self.run_async(self.get_users_list())
-
-            if not users:
-                return []
-
-            if not text:
-                return users
-            else:
-                return [user for user in users if user.startswith(text)]
+            return self.completions(self.chat.presence.users, text)
         return []
 
     def do_yield(self, arg):
@@ -204,19 +127,19 @@ class CowClient(cmd.Cmd):
             print("Используйте: yield <текст сообщения>")
             return
 
-        response = self.run_async(self.execute_command(f"yield {arg}"))
+        response = self.run_async(self.chat.yield_(arg))
         if response:
             print(response)
 
     def do_who(self, arg):
         """Просмотр зарегистрированных пользователей"""
-        response = self.run_async(self.execute_command("who"))
+        response = self.run_async(self.chat.command("who"))
         if response:
             print(response)
 
     def do_cows(self, arg):
         """Просмотр свободных имён коров"""
-        response = self.run_async(self.execute_command("cows"))
+        response = self.run_async(self.chat.command("cows"))
         if response:
             print(response)
 
@@ -225,39 +148,38 @@ class CowClient(cmd.Cmd):
         if arg:
             super().do_help(arg)
         else:
-            response = self.run_async(self.execute_command("help"))
+            response = self.run_async(self.chat.command("help"))
             if response:
                 print(response)
 
     def do_quit(self, arg):
         """Отключиться от сервера"""
-        self.run_async(self.execute_command("quit", False))
+        self.run_async(self.chat.quit())
 
         print("Выход из чата...")
-        self.running = False
-
-        if self.writer:
-            self.writer.close()
-
         return True
 
     do_exit = do_quit
     do_bye = do_quit
 
 
-def run_client(host, port):
+def run_client(host, port, framed=True):
     """Запустить клиент коровьего чата"""
-    client = CowClient(host, port)
+    client = CowClient(host, port, framed)
+    # Оболочка стартует, как только соединение установлено или не удалось
+    ready = threading.Event()
 
     def start_async_loop():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         client.loop = loop
 
-        if not loop.run_until_complete(client.connect()):
+        connected = loop.run_until_complete(client.connect())
+        ready.set()
+        if not connected:
             return
 
-        message_task = loop.create_task(client.message_receiver())
+        message_task = loop.create_task(client.message_printer())
 
         try:
             loop.run_forever()
@@ -265,24 +187,17 @@ def run_client(host, port):
             pass
         finally:
             message_task.cancel()
-
-            if client.writer and not client.writer.is_closing():
-                client.writer.close()
-                loop.run_until_complete(client.writer.wait_closed())
-
+            loop.run_until_complete(client.chat.close())
             loop.close()
 
     async_thread = threading.Thread(target=start_async_loop, daemon=True)
     async_thread.start()
 
     try:
-        import time
-        time.sleep(0.5)
+        ready.wait()
 
         if client.running:
             client.cmdloop()
-
-        client.running = False
     except KeyboardInterrupt:
         print("\nВыход из программы...")
     finally:
@@ -293,19 +208,22 @@ def run_client(host, port):
 
 if __name__ == "__main__":
     # Получаем хост и порт из аргументов командной строки
+    # --text — остаться на построчном протоколе, не переходя на кадры
     host = 'localhost'
     port = 1337
+    framed = '--text' not in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != '--text']
 
-    if len(sys.argv) > 1:
-        host = sys.argv[1]
-    if len(sys.argv) > 2:
+    if len(args) > 0:
+        host = args[0]
+    if len(args) > 1:
         try:
-            port = int(sys.argv[2])
+            port = int(args[1])
         except ValueError:
-            print(f"Неверный порт: {sys.argv[2]}")
+            print(f"Неверный порт: {args[1]}")
             sys.exit(1)
 
     try:
-        run_client(host, port)
+        run_client(host, port, framed)
     except KeyboardInterrupt:
         print("\nВыход из программы...")
\ No newline at end of file
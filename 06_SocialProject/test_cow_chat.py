@@ -0,0 +1,66 @@
+import unittest
+
+import cow_chat
+from cow_chat import PUSH, REPLY
+
+ART = (
+    " _____\n"
+    "< муу >\n"
+    " =====\n"
+    "     \\\n"
+    "      \\\n"
+)
+
+STREAM = (
+    "Вы успешно зарегистрировались как 'tux'\n\n"
+    "Зарегистрированные пользователи:\n- tux\n- koala\n\n"
+    "@msg koala default муу\n"
+    "@presence + koala\n"
+    + ART + "\n"
+    "Сообщение отправлено пользователю 'koala'\n\n"
+).encode()
+
+EXPECTED = [
+    (REPLY, "Вы успешно зарегистрировались как 'tux'"),
+    (REPLY, "Зарегистрированные пользователи:\n- tux\n- koala"),
+    (PUSH, "@msg koala default муу"),
+    (PUSH, "@presence + koala"),
+    (PUSH, ART.rstrip("\n")),
+    (REPLY, "Сообщение отправлено пользователю 'koala'"),
+]
+
+
+class LineParserTest(unittest.TestCase):
+    def test_blocks(self):
+        parser = cow_chat.LineParser()
+        parser.feed(STREAM)
+        self.assertEqual(list(parser.events), EXPECTED)
+
+    def test_byte_by_byte(self):
+        # Строки и буквы UTF-8 режутся между порциями как угодно
+        parser = cow_chat.LineParser()
+        for index in range(len(STREAM)):
+            parser.feed(STREAM[index:index + 1])
+        self.assertEqual(list(parser.events), EXPECTED)
+
+    def test_unfinished_block_waits(self):
+        parser = cow_chat.LineParser()
+        parser.feed("Зарегистрированные пользователи:\n- tux\n".encode())
+        self.assertEqual(list(parser.events), [])
+        parser.feed(b"\r\n")
+        self.assertEqual(list(parser.events), [(REPLY, "Зарегистрированные пользователи:\n- tux")])
+
+    def test_service_line_inside_block_is_text(self):
+        # @ в начале строки внутри многострочного ответа — часть ответа
+        parser = cow_chat.LineParser()
+        parser.feed("Комнаты:\n@room\n\n".encode())
+        self.assertEqual(list(parser.events), [(REPLY, "Комнаты:\n@room")])
+
+    def test_old_server_line_per_block(self):
+        parser = cow_chat.LineParser(blocks=False)
+        parser.feed("Зарегистрированные пользователи:\n- tux\n".encode())
+        self.assertEqual(list(parser.events), [(REPLY, "Зарегистрированные пользователи:"), (REPLY, "- tux")])
+
+
+if __name__ == "__main__":
+    unittest.main()